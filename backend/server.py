@@ -1,37 +1,350 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, Response, status
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPBearer
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.routing import Match
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel, ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
+from bson import Int64, ObjectId
+from bson.errors import InvalidId
 import os
+import re
+import csv
+import ipaddress
+import json
+import base64
+import random
+import asyncio
 import logging
+import time
+import hashlib
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
+from contextlib import asynccontextmanager
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, ValidationError
 from typing import List, Optional
 import uuid
-from datetime import datetime, timezone, timedelta
+from datetime import date, datetime, timezone, timedelta
+from zoneinfo import ZoneInfo
 from passlib.context import CryptContext
 import jwt
+import numpy as np
+try:
+    import orjson
+except ImportError:
+    orjson = None
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# ========== METRICS ==========
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(names: tuple, values: tuple, extra: tuple = ()) -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names + extra[:1], values + extra[1:])]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: tuple, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series: dict = {}
+        # Observed from Motor's worker threads as well as the event loop
+        self._lock = threading.Lock()
+    
+    def observe(self, value: float, *label_values) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+        for label_values, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, label_values, ('le', bound))} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(self.labels, label_values, ('le', '+Inf'))} {count}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, label_values)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, label_values)} {count}")
+        return lines
+
+class Gauge:
+    # Either set directly or computed at scrape time from `collect` -> {label values: value}
+    def __init__(self, name: str, help_text: str, labels: tuple = (), collect=None, kind: str = "gauge"):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.collect = collect
+        self.kind = kind
+        self._values: dict = {}
+    
+    def inc(self, *label_values, amount: float = 1) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+    
+    def dec(self, *label_values) -> None:
+        self.inc(*label_values, amount=-1)
+    
+    def render(self) -> List[str]:
+        values = self.collect() if self.collect is not None else dict(self._values)
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for label_values, value in values.items():
+            lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+METRICS: list = []
+
+def register_metric(metric):
+    METRICS.append(metric)
+    return metric
+
+http_request_duration = register_metric(Histogram(
+    "studyhub_http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status")
+))
+http_requests_in_flight = register_metric(Gauge(
+    "studyhub_http_requests_in_flight", "HTTP requests currently being served", ("method", "route")
+))
+mongo_command_duration = register_metric(Histogram(
+    "studyhub_mongo_command_duration_seconds", "MongoDB command latency", ("collection", "command", "outcome")
+))
+llm_call_duration = register_metric(Histogram(
+    "studyhub_llm_call_duration_seconds", "LLM call latency in AI analysis", ("mode", "outcome")
+))
+
+class MongoCommandListener(monitoring.CommandListener):
+    def __init__(self):
+        self._pending: dict = {}
+    
+    def started(self, event) -> None:
+        collection = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            collection = event.command.get("collection")
+        if not isinstance(collection, str):
+            collection = ""
+        self._pending[(event.connection_id, event.request_id)] = collection
+    
+    def _finish(self, event, outcome: str) -> None:
+        collection = self._pending.pop((event.connection_id, event.request_id), "")
+        mongo_command_duration.observe(event.duration_micros / 1e6, collection, event.command_name, outcome)
+    
+    def succeeded(self, event) -> None:
+        self._finish(event, "ok")
+    
+    def failed(self, event) -> None:
+        self._finish(event, "error")
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+    
+    @staticmethod
+    def route_template(scope) -> str:
+        partial = None
+        for route in app.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+            if match == Match.PARTIAL and partial is None:
+                partial = route.path
+        # Unknown paths share one label so cardinality stays bounded
+        return partial or "unmatched"
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        method = scope["method"]
+        route = self.route_template(scope)
+        status_code = [500]
+        
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_code[0] = message["status"]
+            await send(message)
+        
+        http_requests_in_flight.inc(method, route)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_flight.dec(method, route)
+            http_request_duration.observe(time.perf_counter() - started, method, route, status_code[0])
+
+def render_metrics() -> str:
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# MongoDB connection (created per worker in the lifespan handler, never at import/fork time)
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '10'))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', '300000'))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000'))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', '30000'))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '5000'))
+
+client: Optional[AsyncIOMotorClient] = None
+db = None
+
+def create_mongo_client() -> AsyncIOMotorClient:
+    return AsyncIOMotorClient(
+        mongo_url,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+        waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        event_listeners=[MongoCommandListener()],
+    )
 
 # Security
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes with any other cost are transparently rehashed on the next successful login
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 security = HTTPBearer()
 
 JWT_SECRET_KEY = os.environ['JWT_SECRET_KEY']
 JWT_ALGORITHM = os.environ['JWT_ALGORITHM']
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ['ACCESS_TOKEN_EXPIRE_MINUTES'])
 
+# bcrypt runs in its own thread pool; beyond HASH_QUEUE_LIMIT waiting jobs we answer 503
+HASH_WORKERS = int(os.environ.get('HASH_WORKERS', str(os.cpu_count() or 2)))
+HASH_QUEUE_LIMIT = int(os.environ.get('HASH_QUEUE_LIMIT', '32'))
+
+# Write-behind answer ingestion (off by default: every answer is written before responding)
+ANSWER_WRITE_BEHIND = os.environ.get('ANSWER_WRITE_BEHIND', 'false').lower() == 'true'
+ANSWER_BATCH_SIZE = int(os.environ.get('ANSWER_BATCH_SIZE', '500'))
+ANSWER_FLUSH_INTERVAL_MS = int(os.environ.get('ANSWER_FLUSH_INTERVAL_MS', '200'))
+# Durability bound: never hold more than this many unwritten answers in memory
+ANSWER_MAX_PENDING = int(os.environ.get('ANSWER_MAX_PENDING', '5000'))
+# Max answers accepted by one POST /answers/batch (a full simulado is 45-180 questions)
+ANSWER_BATCH_MAX_ITEMS = int(os.environ.get('ANSWER_BATCH_MAX_ITEMS', '200'))
+
+# Study days and weeks are cut at local midnight of this timezone, not UTC (21:00 in Brasília)
+STUDY_TIMEZONE_NAME = os.environ.get('STUDY_TIMEZONE', 'America/Sao_Paulo')
+STUDY_TIMEZONE = ZoneInfo(STUDY_TIMEZONE_NAME)
+# Study progress: how far back streaks look and how long a time series may be
+STREAK_LOOKBACK_DAYS = int(os.environ.get('STREAK_LOOKBACK_DAYS', '366'))
+MAX_TIMESERIES_DAYS = 366
+
+# Item statistics: questions need this many attempts before a difficulty is suggested;
+# smoothed proportion correct at or above EASY_MIN_P is "easy", at or above MEDIUM_MIN_P "medium"
+ITEM_CALIBRATION_MIN_ATTEMPTS = int(os.environ.get('ITEM_CALIBRATION_MIN_ATTEMPTS', '30'))
+ITEM_EASY_MIN_P = float(os.environ.get('ITEM_EASY_MIN_P', '0.7'))
+ITEM_MEDIUM_MIN_P = float(os.environ.get('ITEM_MEDIUM_MIN_P', '0.4'))
+# Background recalibration period per worker; 0 disables it (POST /item-stats/recalibrate still works)
+ITEM_CALIBRATION_INTERVAL_SECONDS = float(os.environ.get('ITEM_CALIBRATION_INTERVAL_SECONDS', '3600'))
+
+# Bulk question import
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', '500'))
+IMPORT_MAX_LINE_BYTES = int(os.environ.get('IMPORT_MAX_LINE_BYTES', str(1024 * 1024)))
+IMPORT_MAX_REPORTED_ERRORS = int(os.environ.get('IMPORT_MAX_REPORTED_ERRORS', '1000'))
+
+# Next-question selection: max question docs inspected per subject before giving up
+NEXT_QUESTION_SCAN_LIMIT = int(os.environ.get('NEXT_QUESTION_SCAN_LIMIT', '2000'))
+
+# Serialize trusted DB documents directly instead of re-validating them per item
+FAST_RESPONSES = os.environ.get('FAST_RESPONSES', 'true').lower() == 'true'
+
+# Pagination / streaming
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', '200'))
+
+# In-process caches
+QUESTION_CACHE_SIZE = int(os.environ.get('QUESTION_CACHE_SIZE', '10000'))
+QUESTION_CACHE_TTL_SECONDS = float(os.environ.get('QUESTION_CACHE_TTL_SECONDS', '600'))
+AI_CACHE_SIZE = int(os.environ.get('AI_CACHE_SIZE', '10000'))
+AI_CACHE_TTL_SECONDS = float(os.environ.get('AI_CACHE_TTL_SECONDS', '86400'))
+AI_TIMEOUT_SECONDS = float(os.environ.get('AI_TIMEOUT_SECONDS', '20'))
+# Offline stand-in for the LLM (tests, load runs)
+AI_FAKE_LLM = os.environ.get('AI_FAKE_LLM', 'false').lower() == 'true'
+AI_FAKE_LLM_DELAY_MS = int(os.environ.get('AI_FAKE_LLM_DELAY_MS', '500'))
+# Background AI analysis jobs
+AI_JOB_WORKERS = int(os.environ.get('AI_JOB_WORKERS', '4'))
+AI_JOB_QUEUE_LIMIT = int(os.environ.get('AI_JOB_QUEUE_LIMIT', '100'))
+AI_JOB_TTL_SECONDS = int(os.environ.get('AI_JOB_TTL_SECONDS', '3600'))
+AI_JOB_MAX_WAIT_SECONDS = float(os.environ.get('AI_JOB_MAX_WAIT_SECONDS', '25'))
+# Queued/running jobs hold a lease renewed by the owning worker; once it lapses (the worker died)
+# the job is marked failed and the user can submit again
+AI_JOB_LEASE_SECONDS = float(os.environ.get('AI_JOB_LEASE_SECONDS', str(AI_TIMEOUT_SECONDS + 15)))
+# Short TTL: also bounds how long a user change on another worker can go unseen
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '10000'))
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', '30'))
+# Upper bound on how stale another worker's subject writes can look here
+SUBJECT_CATALOG_TTL_SECONDS = float(os.environ.get('SUBJECT_CATALOG_TTL_SECONDS', '30'))
+
+# Admission control for expensive routes: "<tokens>/<seconds>" token buckets per client plus a
+# per-route in-flight cap; requests over either limit are rejected (429/503) instead of queued
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '100000'))
+# Comma-separated CIDRs of the ingress/load balancers; X-Forwarded-For is only read from these peers
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(cidr.strip()) for cidr in os.environ.get('TRUSTED_PROXIES', '').split(',') if cidr.strip()
+]
+# Per-IP buckets (login/register). "auto" enables them only once TRUSTED_PROXIES is set: behind the
+# ingress every student shares the proxy's address. Use "true" when the app is exposed directly
+IP_RATE_LIMIT = os.environ.get('IP_RATE_LIMIT', 'auto').lower()
+IP_RATE_LIMIT_ENABLED = IP_RATE_LIMIT == 'true' or (IP_RATE_LIMIT == 'auto' and bool(TRUSTED_PROXIES))
+RATE_LIMIT_LOGIN = os.environ.get('RATE_LIMIT_LOGIN', '10/60')
+RATE_LIMIT_REGISTER = os.environ.get('RATE_LIMIT_REGISTER', '5/300')
+# Site-wide buckets applied instead while per-IP buckets are off, sized for a whole school's traffic
+RATE_LIMIT_LOGIN_SHARED = os.environ.get('RATE_LIMIT_LOGIN_SHARED', '600/60')
+RATE_LIMIT_REGISTER_SHARED = os.environ.get('RATE_LIMIT_REGISTER_SHARED', '120/60')
+# Per-account login attempts, keyed on the e-mail so it holds whatever the proxy setup is
+RATE_LIMIT_LOGIN_EMAIL = os.environ.get('RATE_LIMIT_LOGIN_EMAIL', '10/300')
+RATE_LIMIT_AI = os.environ.get('RATE_LIMIT_AI', '6/60')
+MAX_CONCURRENT_LOGIN = int(os.environ.get('MAX_CONCURRENT_LOGIN', '32'))
+MAX_CONCURRENT_REGISTER = int(os.environ.get('MAX_CONCURRENT_REGISTER', '16'))
+MAX_CONCURRENT_AI = int(os.environ.get('MAX_CONCURRENT_AI', '8'))
+
+# Time-windowed ranking buckets are dropped by a TTL index after this long
+RANKING_BUCKET_RETENTION = {
+    "week": timedelta(days=int(os.environ.get('RANKING_WEEK_RETENTION_DAYS', '35'))),
+    "month": timedelta(days=int(os.environ.get('RANKING_MONTH_RETENTION_DAYS', '400'))),
+}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup_db_client()
+    try:
+        yield
+    finally:
+        await shutdown_db_client()
+
 # Create the main app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+app.state.ready = False
 api_router = APIRouter(prefix="/api")
 
 # ========== MODELS ==========
@@ -40,7 +353,6 @@ class UserCreate(BaseModel):
     name: str
     email: EmailStr
     password: str
-    role: str = "student"
 
 class UserLogin(BaseModel):
     email: EmailStr
@@ -96,6 +408,20 @@ class QuestionCreate(BaseModel):
     options: List[QuestionOption]
     explanation: str
 
+class QuestionSearchHit(Question):
+    score: float
+
+class ImportRowError(BaseModel):
+    row: int
+    error: str
+
+class ImportReport(BaseModel):
+    total_rows: int
+    imported: int
+    failed: int
+    errors: List[ImportRowError]
+    errors_truncated: bool = False
+
 class Answer(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -111,6 +437,19 @@ class AnswerSubmit(BaseModel):
     selected_option: int
     time_spent: int
 
+class AnswerBatchSubmit(BaseModel):
+    answers: List[AnswerSubmit] = Field(..., min_length=1, max_length=ANSWER_BATCH_MAX_ITEMS)
+
+class AnswerBatchItem(BaseModel):
+    question_id: str
+    status: str  # "graded", "not_found" or "invalid_option"
+    answer: Optional[Answer] = None
+
+class AnswerBatchResult(BaseModel):
+    answered: int
+    correct: int
+    items: List[AnswerBatchItem]
+
 class Result(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -127,6 +466,57 @@ class RankingUser(BaseModel):
     correct_answers: int
     accuracy: float
 
+class RankingPosition(BaseModel):
+    position: Optional[int] = None
+    total_questions: int = 0
+    correct_answers: int = 0
+    accuracy: float = 0.0
+
+class StudyDay(BaseModel):
+    day: str
+    answered: int = 0
+    correct: int = 0
+    time_spent: int = 0
+
+class WeeklyProgress(BaseModel):
+    week_start: str
+    weekly_goal: int
+    answered: int
+    correct: int
+    accuracy: float
+    time_spent: int
+    remaining: int
+    goal_reached: bool
+    days: List[StudyDay]
+
+class StudyStreak(BaseModel):
+    current: int
+    longest: int
+    last_study_day: Optional[str] = None
+
+class OptionStats(BaseModel):
+    option: int
+    count: int
+    share: float
+
+class ItemStats(BaseModel):
+    question_id: str
+    subject_id: str
+    difficulty: Optional[str] = None
+    attempts: int
+    correct: int
+    p_correct: float
+    mean_time_spent: float
+    options: List[OptionStats]
+    suggested_difficulty: Optional[str] = None
+    calibrated_at: Optional[str] = None
+
+class CalibrationSummary(BaseModel):
+    calibrated: int
+    mismatched: int
+    suggested: dict
+    calibrated_at: str
+
 class AIAnalysisRequest(BaseModel):
     user_id: str
 
@@ -135,13 +525,49 @@ class AIAnalysisResponse(BaseModel):
     recommendations: str
     study_plan: str
 
+class AIJob(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    status: str
+    result: Optional[AIAnalysisResponse] = None
+    error: Optional[str] = None
+    created_at: str
+    updated_at: str
+
 # ========== AUTH HELPERS ==========
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+class BoundedExecutor:
+    def __init__(self, workers: int, queue_limit: int, name: str):
+        self.max_pending = workers + queue_limit
+        self.pending = 0
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+    
+    async def run(self, func, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server busy, please retry",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self.pending -= 1
+    
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+hash_executor = BoundedExecutor(HASH_WORKERS, HASH_QUEUE_LIMIT, "bcrypt")
+
+async def hash_password(password: str) -> str:
+    return await hash_executor.run(pwd_context.hash, password)
+
+async def verify_password(plain_password: str, hashed_password: str) -> tuple:
+    # Returns (valid, new_hash); new_hash is set when the stored hash uses outdated parameters
+    return await hash_executor.run(pwd_context.verify_and_update, plain_password, hashed_password)
 
 def create_access_token(data: dict) -> str:
     to_encode = data.copy()
@@ -165,19 +591,1832 @@ async def get_current_user(authorization: str = Depends(security)) -> dict:
     except jwt.PyJWTError:
         raise credentials_exception
     
-    user = await db.users.find_one({"id": user_id}, {"_id": 0})
+    user = user_cache.get(user_id)
     if user is None:
-        raise credentials_exception
+        user = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
+        if user is None:
+            raise credentials_exception
+        user_cache.set(user_id, user)
     return user
 
+def require_role(*roles: str):
+    async def checker(current_user: dict = Depends(get_current_user)) -> dict:
+        if current_user.get("role") not in roles:
+            raise HTTPException(status_code=403, detail="Forbidden")
+        return current_user
+    return checker
+
+# ========== ADMISSION CONTROL ==========
+
+class TokenBuckets:
+    # Per-key token buckets in an LRU-bounded dict; an evicted key simply starts again with a full bucket
+    def __init__(self, tokens: float, seconds: float, max_keys: int):
+        self.capacity = tokens
+        self.refill_rate = tokens / seconds
+        self.max_keys = max_keys
+        self.evicted = 0
+        self._buckets: OrderedDict = OrderedDict()
+    
+    def take(self, key: str) -> float:
+        # Returns 0 when a token was taken, otherwise the seconds until one is available
+        now = time.monotonic()
+        bucket = self._buckets.pop(key, None)
+        if bucket is None:
+            tokens = self.capacity
+        else:
+            tokens = min(self.capacity, bucket[0] + (now - bucket[1]) * self.refill_rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.refill_rate
+        self._buckets[key] = [tokens, now]
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+            self.evicted += 1
+        return wait
+    
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+def parse_rate(spec: str) -> tuple:
+    tokens, seconds = spec.split("/")
+    return float(tokens), float(seconds)
+
+class AdmissionPolicy:
+    def __init__(self, name: str, rate: str, max_concurrent: int, shared_rate: Optional[str] = None):
+        self.name = name
+        self.buckets = TokenBuckets(*parse_rate(rate), RATE_LIMIT_MAX_KEYS)
+        # One bucket for requests that cannot be told apart by client (key=None)
+        self.shared_bucket = TokenBuckets(*parse_rate(shared_rate), 1) if shared_rate else None
+        self.max_concurrent = max_concurrent
+        self.in_flight = 0
+        self.shed = {"rate_limited": 0, "overloaded": 0}
+    
+    def check_rate(self, key: Optional[str]) -> None:
+        if key is None:
+            if self.shared_bucket is None:
+                return
+            wait = self.shared_bucket.take("*")
+        else:
+            wait = self.buckets.take(key)
+        if wait:
+            self.shed["rate_limited"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests, please retry later",
+                headers={"Retry-After": str(max(1, round(wait)))},
+            )
+    
+    def check_capacity(self) -> None:
+        if self.in_flight >= self.max_concurrent:
+            self.shed["overloaded"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server busy, please retry",
+                headers={"Retry-After": "1"},
+            )
+    
+    def enter(self, key: Optional[str]) -> None:
+        # key=None takes from the shared bucket, if the policy has one
+        self.check_rate(key)
+        self.check_capacity()
+        self.in_flight += 1
+    
+    def leave(self) -> None:
+        self.in_flight -= 1
+    
+    def stats(self) -> dict:
+        return {"in_flight": self.in_flight, "tracked_keys": len(self.buckets),
+                "evicted_keys": self.buckets.evicted, **self.shed}
+
+login_admission = AdmissionPolicy("login", RATE_LIMIT_LOGIN, MAX_CONCURRENT_LOGIN, RATE_LIMIT_LOGIN_SHARED)
+register_admission = AdmissionPolicy("register", RATE_LIMIT_REGISTER, MAX_CONCURRENT_REGISTER,
+                                     RATE_LIMIT_REGISTER_SHARED)
+# Token bucket only: the in-flight cap is login_admission's
+login_email_admission = AdmissionPolicy("login_email", RATE_LIMIT_LOGIN_EMAIL, MAX_CONCURRENT_LOGIN)
+ai_admission = AdmissionPolicy("ai_analyze", RATE_LIMIT_AI, MAX_CONCURRENT_AI)
+ADMISSION_POLICIES = (login_admission, register_admission, login_email_admission, ai_admission)
+
+def is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+def client_ip(request: Request) -> str:
+    peer = request.client.host if request.client else "unknown"
+    if not is_trusted_proxy(peer):
+        return peer
+    # Walk X-Forwarded-For from the right: the first hop not added by our own proxies is the client.
+    # Entries further left are client-supplied and could be forged
+    hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if not is_trusted_proxy(hop):
+            return hop
+    return hops[0] if hops else peer
+
+def admit_by_ip(policy: AdmissionPolicy):
+    async def dependency(request: Request):
+        if not RATE_LIMIT_ENABLED:
+            yield
+            return
+        policy.enter(client_ip(request) if IP_RATE_LIMIT_ENABLED else None)
+        try:
+            yield
+        finally:
+            policy.leave()
+    return dependency
+
+def admit_by_user(policy: AdmissionPolicy):
+    # get_current_user is resolved once per request, so the route's own Depends reuses this lookup
+    async def dependency(current_user: dict = Depends(get_current_user)):
+        if not RATE_LIMIT_ENABLED:
+            yield
+            return
+        policy.enter(current_user["id"])
+        try:
+            yield
+        finally:
+            policy.leave()
+    return dependency
+
+def rate_limit_by_user(policy: AdmissionPolicy):
+    # Token bucket only: for streaming routes, whose slot is held by admitted_stream instead
+    async def dependency(current_user: dict = Depends(get_current_user)):
+        if RATE_LIMIT_ENABLED:
+            policy.check_rate(current_user["id"])
+            policy.check_capacity()
+    return dependency
+
+async def admitted_stream(policy: AdmissionPolicy, stream):
+    # yield dependencies exit before a StreamingResponse body starts, so the in-flight slot of a
+    # streaming route is taken and released around the body itself
+    if RATE_LIMIT_ENABLED:
+        if policy.in_flight >= policy.max_concurrent:
+            policy.shed["overloaded"] += 1
+            yield sse_event("error", {"detail": "Server busy, please retry"})
+            return
+        policy.in_flight += 1
+    try:
+        async for chunk in stream:
+            yield chunk
+    finally:
+        if RATE_LIMIT_ENABLED:
+            policy.leave()
+        await stream.aclose()
+
+# ========== CACHES ==========
+
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+    
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+    
+    def set(self, key, value) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+    
+    def invalidate(self, key) -> None:
+        self._data.pop(key, None)
+    
+    def clear(self) -> None:
+        self._data.clear()
+    
+    def stats(self) -> dict:
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+# Questions are immutable once created, so grading can be served from memory
+question_cache = TTLCache(QUESTION_CACHE_SIZE, QUESTION_CACHE_TTL_SECONDS)
+
+# Authenticated principals keyed by the token `sub`; call invalidate() on any user update
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
+
+async def get_question_doc(question_id: str) -> Optional[dict]:
+    question = question_cache.get(question_id)
+    if question is None:
+        question = await db.questions.find_one({"id": question_id}, {"_id": 0})
+        if question is not None:
+            question_cache.set(question_id, question)
+    return question
+
+async def get_question_docs(question_ids: List[str]) -> dict:
+    questions = {}
+    missing = []
+    for question_id in set(question_ids):
+        question = question_cache.get(question_id)
+        if question is None:
+            missing.append(question_id)
+        else:
+            questions[question_id] = question
+    if missing:
+        async for question in db.questions.find({"id": {"$in": missing}}, {"_id": 0}):
+            question_cache.set(question["id"], question)
+            questions[question["id"]] = question
+    return questions
+
+class SubjectCatalog:
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.version = 0
+        self._loaded_version = -1
+        self._loaded_at = 0.0
+        self._body = b""
+        self._etag = ""
+        self._lock = asyncio.Lock()
+    
+    def invalidate(self) -> None:
+        self.version += 1
+    
+    def _fresh(self) -> bool:
+        return self._loaded_version == self.version and time.monotonic() - self._loaded_at < self.ttl
+    
+    async def get(self) -> tuple:
+        if not self._fresh():
+            async with self._lock:
+                if not self._fresh():
+                    version = self.version
+                    subjects = await db.subjects.find({}, {"_id": 0}).to_list(100)
+                    body = json.dumps(
+                        [Subject(**subject).model_dump() for subject in subjects], ensure_ascii=False
+                    ).encode()
+                    # Content-derived ETag, so every worker agrees on it
+                    self._body = body
+                    self._etag = f'"{hashlib.sha1(body).hexdigest()}"'
+                    self._loaded_version = version
+                    self._loaded_at = time.monotonic()
+        return self._body, self._etag
+
+subject_catalog = SubjectCatalog(SUBJECT_CATALOG_TTL_SECONDS)
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+# ========== INDEXES ==========
+
+# Every hot lookup in the routes below must be covered by one of these.
+INDEX_SPECS = {
+    "users": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "subjects": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "questions": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("subject_id", ASCENDING), ("difficulty", ASCENDING), ("_id", ASCENDING)], name="subject_difficulty_id"),
+        IndexModel([("subject_id", ASCENDING), ("_id", ASCENDING)], name="subject_id"),
+        IndexModel([("difficulty", ASCENDING), ("_id", ASCENDING)], name="difficulty_id"),
+        IndexModel([("ordinal", ASCENDING)], name="ordinal_unique", unique=True,
+                   partialFilterExpression={"ordinal": {"$exists": True}}),
+        IndexModel([("subject_id", ASCENDING), ("ordinal", ASCENDING)], name="subject_ordinal"),
+        IndexModel([("subject_id", ASCENDING), ("difficulty", ASCENDING), ("ordinal", ASCENDING)],
+                   name="subject_difficulty_ordinal"),
+        # Portuguese stemming, case- and accent-insensitive (text index v3); statement matches rank highest
+        IndexModel([("question_text", TEXT), ("options.text", TEXT), ("explanation", TEXT)], name="question_search",
+                   weights={"question_text": 10, "options.text": 5, "explanation": 2},
+                   default_language="portuguese", language_override="search_language"),
+    ],
+    "answered_sets": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+    ],
+    "question_stats": [
+        IndexModel([("question_id", ASCENDING)], name="question_id_unique", unique=True),
+        IndexModel([("subject_id", ASCENDING), ("attempts", DESCENDING)], name="subject_attempts"),
+    ],
+    "study_days": [
+        IndexModel([("user_id", ASCENDING), ("day", DESCENDING)], name="user_day_unique", unique=True),
+    ],
+    "answers": [
+        IndexModel([("user_id", ASCENDING), ("_id", ASCENDING)], name="user_id_id"),
+        # Lets write-behind and seed retries re-insert a batch without duplicating rows
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "results": [
+        IndexModel([("user_id", ASCENDING), ("subject_id", ASCENDING)], name="user_subject_unique", unique=True),
+    ],
+    "ai_jobs": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("status", ASCENDING)], name="user_status"),
+        # At most one queued/running job per user, even when submits race
+        IndexModel([("user_id", ASCENDING)], name="user_active_unique", unique=True,
+                   partialFilterExpression={"active": True}),
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "leaderboard": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+        IndexModel([("correct_answers", DESCENDING), ("user_id", ASCENDING)], name="correct_desc"),
+    ],
+    "ranking_buckets": [
+        IndexModel([("board", ASCENDING), ("user_id", ASCENDING)], name="board_user_unique", unique=True),
+        IndexModel([("board", ASCENDING), ("correct_answers", DESCENDING), ("user_id", ASCENDING)], name="board_correct_desc"),
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+}
+
+# Data written before the unique indexes existed may violate them; merge those duplicates first.
+# Destructive, so it runs once from scripts/index_report.py --ensure, never on worker startup
+async def duplicate_groups(collection, keys: List[str]):
+    # Yields the _ids of each group of documents sharing `keys`, oldest first
+    async for group in collection.aggregate([
+        {"$group": {"_id": {key: f"${key}" for key in keys}, "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ], allowDiskUse=True):
+        yield sorted(group["ids"])
+
+async def merge_duplicate_users(database, ids: list) -> None:
+    # Login always found the oldest account, so newer duplicates are folded into it
+    users = await database.users.find({"_id": {"$in": ids}}, {"_id": 1, "id": 1}).sort("_id", ASCENDING).to_list(None)
+    keep, others = users[0]["id"], [user["id"] for user in users[1:]]
+    for collection_name in ("answers", "results"):
+        await database[collection_name].update_many({"user_id": {"$in": others}}, {"$set": {"user_id": keep}})
+    await database.users.delete_many({"_id": {"$in": ids[1:]}})
+
+async def merge_duplicate_results(database, ids: list) -> None:
+    # Each extra row is deleted before its counts are added, so a concurrent or repeated run
+    # can only fold a row in once
+    for duplicate_id in ids[1:]:
+        result = await database.results.find_one_and_delete({"_id": duplicate_id})
+        if result is not None:
+            await database.results.update_one({"_id": ids[0]}, {"$inc": {
+                "total_questions": result.get("total_questions", 0),
+                "correct_answers": result.get("correct_answers", 0),
+            }})
+    keep = await database.results.find_one({"_id": ids[0]})
+    total, correct = keep.get("total_questions", 0), keep.get("correct_answers", 0)
+    await database.results.update_one(
+        {"_id": ids[0]}, {"$set": {"accuracy": correct / total * 100 if total else 0.0}}
+    )
+
+async def drop_duplicate_answers(database, ids: list) -> None:
+    await database.answers.delete_many({"_id": {"$in": ids[1:]}})
+
+# (collection, unique index) -> (keys, merge); users first, since merging them can duplicate results
+DEDUPE_BEFORE_UNIQUE = {
+    ("users", "email_unique"): (["email"], merge_duplicate_users),
+    ("results", "user_subject_unique"): (["user_id", "subject_id"], merge_duplicate_results),
+    ("answers", "id_unique"): (["id"], drop_duplicate_answers),
+}
+
+async def dedupe_for_unique_indexes(database) -> None:
+    for (collection_name, index_name), (keys, merge) in DEDUPE_BEFORE_UNIQUE.items():
+        collection = database[collection_name]
+        if index_name in await collection.index_information():
+            continue
+        merged = 0
+        async for ids in duplicate_groups(collection, keys):
+            await merge(database, ids)
+            merged += 1
+        if merged:
+            logger.warning(f"Merged {merged} duplicate {collection_name} groups before creating {index_name}")
+
+def index_key_matches(current: dict, spec: dict) -> bool:
+    # Text indexes are stored under internal _fts/_ftsx keys; compare their indexed fields instead
+    if TEXT in spec["key"].values() and "weights" in current:
+        return set(current["weights"]) == set(spec["key"])
+    return list(current["key"]) == list(spec["key"].items())
+
+async def ensure_indexes(database, dedupe: bool = False) -> None:
+    if dedupe:
+        await dedupe_for_unique_indexes(database)
+    
+    for collection_name, models in INDEX_SPECS.items():
+        try:
+            await database[collection_name].create_indexes(models)
+        except OperationFailure as e:
+            if e.code != 11000:
+                raise
+            raise RuntimeError(
+                f"Duplicate {collection_name} documents block a unique index; "
+                f"run python scripts/index_report.py --ensure once to merge them"
+            ) from e
+    
+    # Verify that everything we asked for is actually there
+    missing = []
+    for collection_name, models in INDEX_SPECS.items():
+        existing = await database[collection_name].index_information()
+        for model in models:
+            spec = model.document
+            current = existing.get(spec["name"])
+            if current is None or not index_key_matches(current, spec) \
+                    or bool(current.get("unique")) != bool(spec.get("unique")):
+                missing.append(f"{collection_name}.{spec['name']}")
+    if missing:
+        raise RuntimeError(f"Missing or mismatched indexes: {', '.join(missing)}")
+
+async def index_usage_report(database) -> List[dict]:
+    report = []
+    for collection_name, models in INDEX_SPECS.items():
+        expected = {model.document["name"] for model in models}
+        stats = await database[collection_name].aggregate([{"$indexStats": {}}]).to_list(None)
+        seen = set()
+        for stat in stats:
+            seen.add(stat["name"])
+            report.append({
+                "collection": collection_name,
+                "name": stat["name"],
+                "key": dict(stat["key"]),
+                "ops": stat["accesses"]["ops"],
+                "since": stat["accesses"]["since"].isoformat(),
+                "expected": stat["name"] in expected or stat["name"] == "_id_",
+            })
+        for name in sorted(expected - seen):
+            report.append({
+                "collection": collection_name,
+                "name": name,
+                "key": None,
+                "ops": 0,
+                "since": None,
+                "expected": True,
+            })
+    return report
+
+# ========== RESULTS ==========
+
+def counter_delta_pipeline(answered: int, correct: int, extra: dict) -> List[dict]:
+    # Update pipeline so accuracy is recomputed server-side from the new counters
+    return [
+        {"$set": {
+            **extra,
+            "total_questions": {"$add": [{"$ifNull": ["$total_questions", 0]}, answered]},
+            "correct_answers": {"$add": [{"$ifNull": ["$correct_answers", 0]}, correct]},
+        }},
+        {"$set": {
+            "accuracy": {"$multiply": [{"$divide": ["$correct_answers", "$total_questions"]}, 100]}
+        }},
+    ]
+
+def result_delta_pipeline(answered: int, correct: int) -> List[dict]:
+    return counter_delta_pipeline(answered, correct, {
+        "id": {"$ifNull": ["$id", str(uuid.uuid4())]},
+        "last_updated": datetime.now(timezone.utc).isoformat(),
+    })
+
+async def apply_result_delta(user_id: str, subject_id: str, answered: int, correct: int) -> None:
+    query = {"user_id": user_id, "subject_id": subject_id}
+    try:
+        await db.results.update_one(query, result_delta_pipeline(answered, correct), upsert=True)
+    except DuplicateKeyError:
+        # Lost a concurrent upsert race on results(user_id, subject_id); the row exists now
+        await db.results.update_one(query, result_delta_pipeline(answered, correct))
+
+async def bulk_upsert(collection, updates: List[tuple]) -> None:
+    # updates are (filter, update pipeline) pairs applied in one unordered bulk_write
+    try:
+        await collection.bulk_write([UpdateOne(query, update, upsert=True) for query, update in updates], ordered=False)
+    except BulkWriteError as e:
+        errors = e.details["writeErrors"]
+        if any(error["code"] != 11000 for error in errors):
+            raise
+        # Lost concurrent upsert races; those rows exist now
+        for error in errors:
+            query, update = updates[error["index"]]
+            await collection.update_one(query, update)
+
+# ========== LEADERBOARD ==========
+
+# One document per user, maintained on answer submission and sorted by an index
+LEADERBOARD_SORT = [("correct_answers", DESCENDING), ("user_id", ASCENDING)]
+
+def leaderboard_delta_pipeline(name: str, answered: int, correct: int) -> List[dict]:
+    return counter_delta_pipeline(answered, correct, {"name": {"$literal": name}})
+
+async def apply_leaderboard_delta(user_id: str, name: str, answered: int, correct: int) -> None:
+    query = {"user_id": user_id}
+    try:
+        await db.leaderboard.update_one(query, leaderboard_delta_pipeline(name, answered, correct), upsert=True)
+    except DuplicateKeyError:
+        await db.leaderboard.update_one(query, leaderboard_delta_pipeline(name, answered, correct))
+
+async def rebuild_leaderboard(database) -> None:
+    await database.results.aggregate([
+        {"$group": {
+            "_id": "$user_id",
+            "total_questions": {"$sum": "$total_questions"},
+            "correct_answers": {"$sum": "$correct_answers"}
+        }},
+        {"$lookup": {"from": "users", "localField": "_id", "foreignField": "id", "as": "user"}},
+        {"$unwind": "$user"},
+        {"$project": {
+            "_id": 0,
+            "user_id": "$_id",
+            "name": "$user.name",
+            "total_questions": 1,
+            "correct_answers": 1,
+            "accuracy": {"$multiply": [{"$divide": ["$correct_answers", "$total_questions"]}, 100]}
+        }},
+        {"$merge": {"into": "leaderboard", "on": "user_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]).to_list(None)
+    
+    # All-time per-subject boards can be rebuilt from results; windowed ones only accrue forward
+    await database.results.aggregate([
+        {"$lookup": {"from": "users", "localField": "user_id", "foreignField": "id", "as": "user"}},
+        {"$unwind": "$user"},
+        {"$project": {
+            "_id": 0,
+            "board": {"$concat": ["subject:", "$subject_id"]},
+            "user_id": 1,
+            "name": "$user.name",
+            "total_questions": 1,
+            "correct_answers": 1,
+            "accuracy": 1
+        }},
+        {"$merge": {
+            "into": "ranking_buckets",
+            "on": ["board", "user_id"],
+            "whenMatched": "replace",
+            "whenNotMatched": "insert"
+        }},
+    ]).to_list(None)
+
+# Per-subject and weekly/monthly boards, pre-aggregated per (board, user_id)
+RANKING_WINDOWS = ("week", "month")
+
+def ranking_board(subject_id: Optional[str], window: Optional[str], moment: datetime) -> str:
+    # Weeks and months turn over at local midnight, like the study days behind the weekly goal
+    moment = moment.astimezone(STUDY_TIMEZONE)
+    parts = []
+    if subject_id:
+        parts.append(f"subject:{subject_id}")
+    if window == "week":
+        iso = moment.isocalendar()
+        parts.append(f"week:{iso.year}-W{iso.week:02d}")
+    elif window == "month":
+        parts.append(f"month:{moment.year}-{moment.month:02d}")
+    return ":".join(parts)
+
+def ranking_boards(subject_id: str, moment: datetime) -> List[tuple]:
+    boards = [(ranking_board(subject_id, None, moment), None)]
+    for window in RANKING_WINDOWS:
+        expires_at = moment + RANKING_BUCKET_RETENTION[window]
+        boards.append((ranking_board(None, window, moment), expires_at))
+        boards.append((ranking_board(subject_id, window, moment), expires_at))
+    return boards
+
+def ranking_bucket_update(board: str, user_id: str, name: str, expires_at: Optional[datetime],
+                          answered: int, correct: int) -> tuple:
+    extra = {"name": {"$literal": name}}
+    if expires_at is not None:
+        extra["expires_at"] = expires_at
+    return {"board": board, "user_id": user_id}, counter_delta_pipeline(answered, correct, extra)
+
+async def apply_ranking_bucket_deltas(user_id: str, name: str, subject_id: str, moment: datetime,
+                                      answered: int, correct: int) -> None:
+    await bulk_upsert(db.ranking_buckets, [
+        ranking_bucket_update(board, user_id, name, expires_at, answered, correct)
+        for board, expires_at in ranking_boards(subject_id, moment)
+    ])
+
+async def rebuild_ranking_windows(database) -> None:
+    # Recomputes the weekly/monthly boards still inside their retention from answers, mirroring
+    # ranking_boards(); the bucket expires RANKING_BUCKET_RETENTION after the user's last answer in it
+    now = datetime.now(timezone.utc)
+    since = (now - max(RANKING_BUCKET_RETENTION.values())).isoformat()
+    retention_ms = {window: RANKING_BUCKET_RETENTION[window].total_seconds() * 1000 for window in RANKING_WINDOWS}
+    week = {"$concat": ["week:", {"$dateToString": {"date": "$at", "format": "%G-W%V", "timezone": STUDY_TIMEZONE_NAME}}]}
+    month = {"$concat": ["month:", {"$dateToString": {"date": "$at", "format": "%Y-%m", "timezone": STUDY_TIMEZONE_NAME}}]}
+    subject = {"$concat": ["subject:", "$question.subject_id", ":"]}
+    await database.answers.aggregate([
+        {"$match": {"answered_at": {"$gte": since}}},
+        {"$lookup": {"from": "questions", "localField": "question_id", "foreignField": "id", "as": "question"}},
+        {"$unwind": "$question"},
+        # answered_at is always a UTC isoformat string; seconds precision is enough for bucketing
+        {"$addFields": {"at": {"$dateFromString": {
+            "dateString": {"$substrCP": ["$answered_at", 0, 19]}, "format": "%Y-%m-%dT%H:%M:%S", "timezone": "UTC"
+        }}}},
+        {"$project": {
+            "user_id": 1,
+            "is_correct": 1,
+            "at": 1,
+            "boards": [
+                {"board": week, "window": "week"},
+                {"board": month, "window": "month"},
+                {"board": {"$concat": [subject, week]}, "window": "week"},
+                {"board": {"$concat": [subject, month]}, "window": "month"},
+            ]
+        }},
+        {"$unwind": "$boards"},
+        {"$group": {
+            "_id": {"board": "$boards.board", "user_id": "$user_id"},
+            "window": {"$first": "$boards.window"},
+            "total_questions": {"$sum": 1},
+            "correct_answers": {"$sum": {"$cond": ["$is_correct", 1, 0]}},
+            "last_at": {"$max": "$at"}
+        }},
+        {"$lookup": {"from": "users", "localField": "_id.user_id", "foreignField": "id", "as": "user"}},
+        {"$unwind": "$user"},
+        {"$project": {
+            "_id": 0,
+            "board": "$_id.board",
+            "user_id": "$_id.user_id",
+            "name": "$user.name",
+            "total_questions": 1,
+            "correct_answers": 1,
+            "accuracy": {"$multiply": [{"$divide": ["$correct_answers", "$total_questions"]}, 100]},
+            "expires_at": {"$add": ["$last_at", {"$cond": [
+                {"$eq": ["$window", "week"]}, retention_ms["week"], retention_ms["month"]
+            ]}]}
+        }},
+        {"$merge": {
+            "into": "ranking_buckets",
+            "on": ["board", "user_id"],
+            "whenMatched": "replace",
+            "whenNotMatched": "insert"
+        }},
+    ], allowDiskUse=True).to_list(None)
+
+# ========== ANSWERED SETS ==========
+
+# Each question gets a dense integer ordinal; a user's answered questions are a bitset over
+# ordinals stored as 32-bit words {"w": {"<ordinal // 32>": mask}} in one answered_sets document
+ANSWERED_WORD_BITS = 32
+
+async def reserve_ordinals(database, count: int) -> int:
+    counter = await database.counters.find_one_and_update(
+        {"_id": "question_ordinal"},
+        {"$inc": {"seq": count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return counter["seq"] - count
+
+async def backfill_question_ordinals(database) -> None:
+    missing = database.questions.find({"ordinal": {"$exists": False}}, {"_id": 0, "id": 1}).sort("_id", ASCENDING)
+    batch = []
+    async for question in missing:
+        batch.append(question["id"])
+        if len(batch) >= 1000:
+            await _assign_ordinals(database, batch)
+            batch = []
+    if batch:
+        await _assign_ordinals(database, batch)
+
+async def _assign_ordinals(database, question_ids: List[str]) -> None:
+    start = await reserve_ordinals(database, len(question_ids))
+    # Guarded on $exists so a concurrent backfill on another worker cannot renumber a question
+    await database.questions.bulk_write([
+        UpdateOne({"id": question_id, "ordinal": {"$exists": False}}, {"$set": {"ordinal": start + index}})
+        for index, question_id in enumerate(question_ids)
+    ], ordered=False)
+
+def answered_bits(ordinals) -> dict:
+    words: dict = {}
+    for ordinal in ordinals:
+        word = str(ordinal // ANSWERED_WORD_BITS)
+        words[word] = words.get(word, 0) | (1 << (ordinal % ANSWERED_WORD_BITS))
+    return words
+
+def answered_set_update(words: dict) -> dict:
+    return {"$bit": {f"w.{word}": {"or": Int64(mask)} for word, mask in words.items()}}
+
+async def rebuild_answered_sets(database) -> None:
+    # OR-ing bits is idempotent, so this is safe over sets that are already partly maintained
+    batch = []
+    async for user in database.answers.aggregate([
+        {"$group": {"_id": {"user_id": "$user_id", "question_id": "$question_id"}}},
+        {"$lookup": {"from": "questions", "localField": "_id.question_id", "foreignField": "id", "as": "question"}},
+        {"$unwind": "$question"},
+        {"$group": {"_id": "$_id.user_id", "ordinals": {"$push": "$question.ordinal"}}},
+    ], allowDiskUse=True):
+        words = answered_bits(ordinal for ordinal in user["ordinals"] if ordinal is not None)
+        if words:
+            batch.append(({"user_id": user["_id"]}, answered_set_update(words)))
+        if len(batch) >= 1000:
+            await bulk_upsert(database.answered_sets, batch)
+            batch = []
+    if batch:
+        await bulk_upsert(database.answered_sets, batch)
+
+async def mark_answered(user_id: str, ordinals) -> None:
+    words = answered_bits(ordinal for ordinal in ordinals if ordinal is not None)
+    if words:
+        await bulk_upsert(db.answered_sets, [({"user_id": user_id}, answered_set_update(words))])
+
+def is_answered(words: dict, ordinal: int) -> bool:
+    return bool((words.get(str(ordinal // ANSWERED_WORD_BITS), 0) >> (ordinal % ANSWERED_WORD_BITS)) & 1)
+
+async def pick_unanswered(subject_id: str, difficulty: Optional[str], count: int, words: dict,
+                          exclude: set) -> List[dict]:
+    query = {"subject_id": subject_id}
+    if difficulty:
+        query["difficulty"] = difficulty
+    # Start from a random ordinal and wrap around, so repeated calls do not always return the same questions
+    counter = await db.counters.find_one({"_id": "question_ordinal"})
+    pivot = random.randrange(counter["seq"]) if counter and counter["seq"] else 0
+    picked = []
+    scanned = 0
+    for ordinal_range in ({"$gte": pivot}, {"$lt": pivot}):
+        cursor = db.questions.find({**query, "ordinal": ordinal_range}, {**QUESTION_PROJECTION, "ordinal": 1}) \
+            .sort("ordinal", ASCENDING).batch_size(min(NEXT_QUESTION_SCAN_LIMIT, 500))
+        async for question in cursor:
+            scanned += 1
+            if not is_answered(words, question["ordinal"]) and question["id"] not in exclude:
+                del question["ordinal"]
+                picked.append(question)
+                if len(picked) >= count:
+                    return picked
+            if scanned >= NEXT_QUESTION_SCAN_LIMIT:
+                return picked
+    return picked
+
+async def select_next_questions(user_id: str, count: int, subject_id: Optional[str],
+                                difficulty: Optional[str]) -> List[dict]:
+    answered, results = await asyncio.gather(
+        db.answered_sets.find_one({"user_id": user_id}, {"_id": 0, "w": 1}),
+        db.results.find({"user_id": user_id}, {"_id": 0, "subject_id": 1, "accuracy": 1}).to_list(100),
+    )
+    words = answered.get("w", {}) if answered else {}
+    
+    if subject_id:
+        weights = {subject_id: 1.0}
+    else:
+        # Favor weak subjects; subjects never studied count as 50% accuracy
+        accuracy = {result["subject_id"]: result["accuracy"] for result in results}
+        subjects = await db.subjects.find({}, {"_id": 0, "id": 1}).to_list(100)
+        weights = {subject["id"]: 1 + (100 - accuracy.get(subject["id"], 50)) / 50 for subject in subjects}
+    if not weights:
+        return []
+    
+    quotas: dict = {}
+    for chosen in random.choices(list(weights), weights=list(weights.values()), k=count):
+        quotas[chosen] = quotas.get(chosen, 0) + 1
+    
+    selected: List[dict] = []
+    chosen_ids: set = set()
+    for sid, quota in quotas.items():
+        picked = await pick_unanswered(sid, difficulty, quota, words, chosen_ids)
+        selected.extend(picked)
+        chosen_ids.update(question["id"] for question in picked)
+    
+    # Top up from the weakest subjects when some subject ran out of unanswered questions
+    for sid in sorted(weights, key=weights.get, reverse=True):
+        if len(selected) >= count:
+            break
+        picked = await pick_unanswered(sid, difficulty, count - len(selected), words, chosen_ids)
+        selected.extend(picked)
+        chosen_ids.update(question["id"] for question in picked)
+    
+    random.shuffle(selected)
+    return selected
+
+# ========== STUDY ROLLUPS ==========
+
+# One document per (user_id, local day in STUDY_TIMEZONE) with totals and per-subject counters, so goal progress,
+# streaks and charts read a handful of small documents instead of the user's answers
+def study_day(moment: datetime) -> str:
+    return moment.astimezone(STUDY_TIMEZONE).date().isoformat()
+
+def study_today() -> date:
+    return datetime.now(STUDY_TIMEZONE).date()
+
+def add_study_delta(subject_deltas: dict, subject_id: str, correct: int, time_spent: int) -> None:
+    delta = subject_deltas.setdefault(subject_id, [0, 0, 0])
+    delta[0] += 1
+    delta[1] += correct
+    delta[2] += time_spent
+
+def study_day_update(user_id: str, day: str, subject_deltas: dict) -> tuple:
+    inc = {"answered": 0, "correct": 0, "time_spent": 0}
+    for subject_id, (answered, correct, time_spent) in subject_deltas.items():
+        inc["answered"] += answered
+        inc["correct"] += correct
+        inc["time_spent"] += time_spent
+        inc[f"subjects.{subject_id}.answered"] = answered
+        inc[f"subjects.{subject_id}.correct"] = correct
+        inc[f"subjects.{subject_id}.time_spent"] = time_spent
+    return {"user_id": user_id, "day": day}, {"$inc": inc}
+
+async def rebuild_study_days(database) -> None:
+    await database.answers.aggregate([
+        {"$lookup": {"from": "questions", "localField": "question_id", "foreignField": "id", "as": "question"}},
+        {"$unwind": "$question"},
+        # answered_at is always a UTC isoformat string; the day is taken in STUDY_TIMEZONE like study_day()
+        {"$addFields": {"day": {"$dateToString": {"date": {"$dateFromString": {
+            "dateString": {"$substrCP": ["$answered_at", 0, 19]}, "format": "%Y-%m-%dT%H:%M:%S", "timezone": "UTC"
+        }}, "format": "%Y-%m-%d", "timezone": STUDY_TIMEZONE_NAME}}}},
+        {"$group": {
+            "_id": {"user_id": "$user_id", "day": "$day", "subject_id": "$question.subject_id"},
+            "answered": {"$sum": 1},
+            "correct": {"$sum": {"$cond": ["$is_correct", 1, 0]}},
+            "time_spent": {"$sum": "$time_spent"}
+        }},
+        {"$group": {
+            "_id": {"user_id": "$_id.user_id", "day": "$_id.day"},
+            "answered": {"$sum": "$answered"},
+            "correct": {"$sum": "$correct"},
+            "time_spent": {"$sum": "$time_spent"},
+            "subjects": {"$push": {"k": "$_id.subject_id", "v": {
+                "answered": "$answered", "correct": "$correct", "time_spent": "$time_spent"
+            }}}
+        }},
+        {"$project": {
+            "_id": 0,
+            "user_id": "$_id.user_id",
+            "day": "$_id.day",
+            "answered": 1,
+            "correct": 1,
+            "time_spent": 1,
+            "subjects": {"$arrayToObject": "$subjects"}
+        }},
+        {"$merge": {"into": "study_days", "on": ["user_id", "day"], "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]).to_list(None)
+
+async def load_study_days(user_id: str, first_day: str) -> dict:
+    days = await db.study_days.find(
+        {"user_id": user_id, "day": {"$gte": first_day}},
+        {"_id": 0, "day": 1, "answered": 1, "correct": 1, "time_spent": 1},
+    ).to_list(MAX_TIMESERIES_DAYS)
+    return {day["day"]: day for day in days}
+
+def fill_study_days(days: dict, first: date, count: int) -> List[dict]:
+    series = []
+    for offset in range(count):
+        day = (first + timedelta(days=offset)).isoformat()
+        series.append(days.get(day, {"day": day, "answered": 0, "correct": 0, "time_spent": 0}))
+    return series
+
+def compute_streaks(days: List[str], today: str) -> dict:
+    # days are distinct study days, most recent first; runs[0] is the most recent streak
+    runs = []
+    previous = None
+    for day in days:
+        moment = datetime.fromisoformat(day)
+        if previous is not None and (previous - moment).days == 1:
+            runs[-1] += 1
+        else:
+            runs.append(1)
+        previous = moment
+    # Today's streak stays alive until the user skips a whole day
+    alive = bool(days) and (datetime.fromisoformat(today) - datetime.fromisoformat(days[0])).days <= 1
+    return {
+        "current": runs[0] if alive else 0,
+        "longest": max(runs, default=0),
+        "last_study_day": days[0] if days else None,
+    }
+
+# ========== ITEM STATISTICS ==========
+
+# One question_stats document per question with running counters ($inc on every answer):
+# attempts, correct, total time_spent and a per-selected_option breakdown for distractor analysis
+def add_item_delta(item_deltas: dict, question: dict, answer: dict) -> None:
+    delta = item_deltas.setdefault(question["id"], [question["subject_id"], question.get("difficulty"), 0, 0, 0, {}])
+    delta[2] += 1
+    delta[3] += 1 if answer["is_correct"] else 0
+    delta[4] += answer["time_spent"]
+    option = str(answer["selected_option"])
+    delta[5][option] = delta[5].get(option, 0) + 1
+
+def item_stats_updates(item_deltas: dict) -> List[tuple]:
+    updates = []
+    for question_id, (subject_id, difficulty, attempts, correct, time_spent, options) in item_deltas.items():
+        inc = {"attempts": attempts, "correct": correct, "time_spent": time_spent}
+        inc.update({f"options.{option}": count for option, count in options.items()})
+        updates.append((
+            {"question_id": question_id},
+            {"$inc": inc, "$set": {"subject_id": subject_id, "difficulty": difficulty}},
+        ))
+    return updates
+
+async def apply_item_stats(question: dict, answer: dict) -> None:
+    item_deltas: dict = {}
+    add_item_delta(item_deltas, question, answer)
+    await bulk_upsert(db.question_stats, item_stats_updates(item_deltas))
+
+async def rebuild_question_stats(database) -> None:
+    await database.answers.aggregate([
+        {"$group": {
+            "_id": {"question_id": "$question_id", "option": {"$toString": "$selected_option"}},
+            "count": {"$sum": 1},
+            "correct": {"$sum": {"$cond": ["$is_correct", 1, 0]}},
+            "time_spent": {"$sum": "$time_spent"}
+        }},
+        {"$group": {
+            "_id": "$_id.question_id",
+            "attempts": {"$sum": "$count"},
+            "correct": {"$sum": "$correct"},
+            "time_spent": {"$sum": "$time_spent"},
+            "options": {"$push": {"k": "$_id.option", "v": "$count"}}
+        }},
+        {"$lookup": {"from": "questions", "localField": "_id", "foreignField": "id", "as": "question"}},
+        {"$unwind": "$question"},
+        {"$project": {
+            "_id": 0,
+            "question_id": "$_id",
+            "subject_id": "$question.subject_id",
+            "difficulty": "$question.difficulty",
+            "attempts": 1,
+            "correct": 1,
+            "time_spent": 1,
+            "options": {"$arrayToObject": "$options"}
+        }},
+        {"$merge": {"into": "question_stats", "on": "question_id", "whenMatched": "merge", "whenNotMatched": "insert"}},
+    ]).to_list(None)
+
+def item_stats_view(doc: dict) -> dict:
+    attempts = doc.get("attempts", 0)
+    options = sorted((int(option), count) for option, count in doc.get("options", {}).items())
+    return {
+        "question_id": doc["question_id"],
+        "subject_id": doc["subject_id"],
+        "difficulty": doc.get("difficulty"),
+        "attempts": attempts,
+        "correct": doc.get("correct", 0),
+        "p_correct": doc.get("correct", 0) / attempts if attempts else 0.0,
+        "mean_time_spent": doc.get("time_spent", 0) / attempts if attempts else 0.0,
+        "options": [
+            {"option": option, "count": count, "share": count / attempts if attempts else 0.0}
+            for option, count in options
+        ],
+        "suggested_difficulty": doc.get("suggested_difficulty"),
+        "calibrated_at": doc.get("calibrated_at"),
+    }
+
+def suggest_difficulties(attempts: np.ndarray, correct: np.ndarray) -> tuple:
+    # Laplace-smoothed proportion correct, so a question barely over the attempt threshold is not extreme
+    p = (correct + 1) / (attempts + 2)
+    labels = np.select([p >= ITEM_EASY_MIN_P, p >= ITEM_MEDIUM_MIN_P], ["easy", "medium"], "hard")
+    return p, labels
+
+async def recalibrate_item_difficulty(database) -> dict:
+    stats = await database.question_stats.find(
+        {"attempts": {"$gte": ITEM_CALIBRATION_MIN_ATTEMPTS}},
+        {"_id": 0, "question_id": 1, "difficulty": 1, "attempts": 1, "correct": 1},
+    ).to_list(None)
+    calibrated_at = datetime.now(timezone.utc).isoformat()
+    if not stats:
+        return {"calibrated": 0, "mismatched": 0, "suggested": {}, "calibrated_at": calibrated_at}
+    
+    attempts = np.fromiter((doc["attempts"] for doc in stats), dtype=np.float64, count=len(stats))
+    correct = np.fromiter((doc["correct"] for doc in stats), dtype=np.float64, count=len(stats))
+    p, labels = suggest_difficulties(attempts, correct)
+    current = np.array([doc.get("difficulty") or "" for doc in stats])
+    
+    updates = [
+        UpdateOne({"question_id": doc["question_id"]}, {"$set": {
+            "p_smoothed": float(p[index]),
+            "suggested_difficulty": str(labels[index]),
+            "calibrated_at": calibrated_at,
+        }})
+        for index, doc in enumerate(stats)
+    ]
+    for start in range(0, len(updates), 1000):
+        await database.question_stats.bulk_write(updates[start:start + 1000], ordered=False)
+    
+    names, counts = np.unique(labels, return_counts=True)
+    return {
+        "calibrated": len(stats),
+        "mismatched": int(np.count_nonzero(labels != current)),
+        "suggested": {str(name): int(count) for name, count in zip(names, counts)},
+        "calibrated_at": calibrated_at,
+    }
+
+class ItemCalibrator:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+    
+    def start(self) -> None:
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                summary = await recalibrate_item_difficulty(db)
+                logger.info(f"Item recalibration: {summary['calibrated']} questions, {summary['mismatched']} mismatched")
+            except Exception as e:
+                logger.error(f"Item recalibration failed: {e}")
+    
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+item_calibrator = ItemCalibrator(ITEM_CALIBRATION_INTERVAL_SECONDS)
+
+# ========== WRITE-BEHIND ==========
+
+class AnswerWriteBuffer:
+    def __init__(self, database, batch_size: int, flush_interval: float, max_pending: int):
+        self.database = database
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        # (answer, question, user_name) entries not yet inserted; counters are derived at flush time
+        # from the rows that actually made it into answers
+        self._entries: List[tuple] = []
+        # (collection name, upserts) groups whose answers are inserted but whose counters failed to apply;
+        # failing to apply them never refuses new answers
+        self._pending_updates: List[tuple] = []
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+    
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def add(self, answer: dict, question: dict, user_name: str) -> None:
+        await self.add_many([(answer, question, user_name)])
+    
+    async def add_many(self, entries: List[tuple]) -> None:
+        # All or nothing: on a 503 none of the entries are buffered, so the client's retry cannot duplicate them
+        if len(self._entries) + len(entries) > self.max_pending:
+            try:
+                await self.flush()
+            except Exception as e:
+                # Backpressure: refuse new answers instead of holding more than max_pending unwritten
+                logger.error(f"Answer write-behind flush failed at capacity: {e}")
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Server busy, please retry",
+                    headers={"Retry-After": "1"},
+                )
+        self._entries.extend(entries)
+        if len(self._entries) >= self.batch_size:
+            self._wakeup.set()
+    
+    async def flush(self) -> None:
+        async with self._lock:
+            entries, self._entries = self._entries, []
+            if entries:
+                try:
+                    inserted = await self._insert(entries)
+                except Exception:
+                    # Nothing is known to be written; answers.id is unique, so retrying cannot duplicate rows
+                    self._entries = entries + self._entries
+                    raise
+                self._pending_updates.extend(self._counter_updates(inserted))
+            await self._apply_updates()
+    
+    async def _insert(self, entries: List[tuple]) -> List[tuple]:
+        try:
+            await self.database.answers.insert_many([answer for answer, _, _ in entries], ordered=False)
+            return entries
+        except BulkWriteError as e:
+            failed = set()
+            for error in e.details["writeErrors"]:
+                # Duplicate id: written by an earlier attempt at this batch, so it still counts
+                if error["code"] != 11000:
+                    failed.add(error["index"])
+                    logger.error(f"Dropping answer {entries[error['index']][0]['id']}: {error.get('errmsg')}")
+            return [entry for index, entry in enumerate(entries) if index not in failed]
+    
+    def _counter_updates(self, entries: List[tuple]) -> List[tuple]:
+        # Coalesce results counters per (user_id, subject_id), leaderboard counters per user, etc.
+        deltas: dict = {}
+        user_deltas: dict = {}
+        bucket_deltas: dict = {}
+        answered: dict = {}
+        study_deltas: dict = {}
+        item_deltas: dict = {}
+        for answer, question, user_name in entries:
+            user_id, subject_id = answer["user_id"], question["subject_id"]
+            correct = 1 if answer["is_correct"] else 0
+            delta = deltas.setdefault((user_id, subject_id), [0, 0])
+            delta[0] += 1
+            delta[1] += correct
+            user_delta = user_deltas.setdefault(user_id, [user_name, 0, 0])
+            user_delta[1] += 1
+            user_delta[2] += correct
+            moment = datetime.fromisoformat(answer["answered_at"])
+            for board, expires_at in ranking_boards(subject_id, moment):
+                bucket_delta = bucket_deltas.setdefault((board, user_id), [user_name, expires_at, 0, 0])
+                bucket_delta[2] += 1
+                bucket_delta[3] += correct
+            if question.get("ordinal") is not None:
+                answered.setdefault(user_id, set()).add(question["ordinal"])
+            add_study_delta(study_deltas.setdefault((user_id, study_day(moment)), {}), subject_id, correct,
+                            answer["time_spent"])
+            add_item_delta(item_deltas, question, answer)
+        
+        updates = [
+            ("results", [
+                ({"user_id": user_id, "subject_id": subject_id}, result_delta_pipeline(answered_count, correct))
+                for (user_id, subject_id), (answered_count, correct) in deltas.items()
+            ]),
+            ("leaderboard", [
+                ({"user_id": user_id}, leaderboard_delta_pipeline(name, answered_count, correct))
+                for user_id, (name, answered_count, correct) in user_deltas.items()
+            ]),
+            ("ranking_buckets", [
+                ranking_bucket_update(board, user_id, name, expires_at, answered_count, correct)
+                for (board, user_id), (name, expires_at, answered_count, correct) in bucket_deltas.items()
+            ]),
+            ("answered_sets", [
+                ({"user_id": user_id}, answered_set_update(answered_bits(ordinals)))
+                for user_id, ordinals in answered.items()
+            ]),
+            ("study_days", [
+                study_day_update(user_id, day, subject_deltas)
+                for (user_id, day), subject_deltas in study_deltas.items()
+            ]),
+            ("question_stats", item_stats_updates(item_deltas)),
+        ]
+        return [(collection_name, ops) for collection_name, ops in updates if ops]
+    
+    async def _apply_group(self, collection_name: str, ops: List[tuple]) -> List[tuple]:
+        # Returns the ops to retry on the next flush. The bulk write is unordered, so after a partial
+        # failure only the failed ops are retried; the others already applied and must not count twice
+        try:
+            await self.database[collection_name].bulk_write(
+                [UpdateOne(query, update, upsert=True) for query, update in ops], ordered=False
+            )
+            return []
+        except BulkWriteError as e:
+            retry = []
+            for error in e.details["writeErrors"]:
+                if error["code"] == 11000:
+                    # Lost a concurrent upsert race; the retry updates the row that exists now
+                    retry.append(ops[error["index"]])
+                else:
+                    logger.error(f"Dropping write-behind {collection_name} update: {error.get('errmsg')}")
+            return retry
+        except PyMongoError as e:
+            # No per-op result came back (connection lost after pymongo's own retry): retry the group whole
+            logger.error(f"Answer write-behind {collection_name} update failed, will retry: {e}")
+            return ops
+        except Exception as e:
+            # Not a database error (e.g. an update that cannot be encoded): retrying cannot help
+            logger.error(f"Dropping write-behind {collection_name} updates: {e!r}")
+            return []
+    
+    async def _apply_updates(self) -> None:
+        remaining = []
+        for collection_name, ops in self._pending_updates:
+            retry = await self._apply_group(collection_name, ops)
+            if retry:
+                remaining.append((collection_name, retry))
+        # Bounded like the answers themselves: past max_pending ops the oldest counters are given up
+        dropped = 0
+        while sum(len(ops) for _, ops in remaining) > self.max_pending:
+            dropped += len(remaining.pop(0)[1])
+        if dropped:
+            logger.error(f"Answer write-behind dropped {dropped} counter updates pending retry")
+        self._pending_updates = remaining
+    
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Answer write-behind flush failed: {e}")
+    
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Answer write-behind final flush failed, {len(self._entries)} answers unwritten: {e}")
+        if self._pending_updates:
+            logger.error(f"Answer write-behind closing with {len(self._pending_updates)} counter group(s) unapplied")
+
+# Created on startup when ANSWER_WRITE_BEHIND is enabled
+answer_buffer: Optional[AnswerWriteBuffer] = None
+
+# ========== SERIALIZATION ==========
+
+# Trusted DB documents are projected to the response model's fields and encoded directly,
+# skipping per-item model validation; response_model still documents the schema
+def model_projection(model) -> dict:
+    return {**{field: 1 for field in model.model_fields}, "_id": 0}
+
+QUESTION_PROJECTION = model_projection(Question)
+ANSWER_PROJECTION = model_projection(Answer)
+RESULT_PROJECTION = model_projection(Result)
+
+if orjson is not None:
+    def dumps_json(content) -> bytes:
+        return orjson.dumps(content)
+else:
+    def dumps_json(content) -> bytes:
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+
+def json_response(content, headers: Optional[dict] = None) -> Response:
+    return Response(content=dumps_json(content), media_type="application/json", headers=headers)
+
+# ========== PAGINATION ==========
+
+# Keyset pagination over _id; the cursor is the last _id of the previous page
+def encode_cursor(last_id: ObjectId) -> str:
+    return base64.urlsafe_b64encode(last_id.binary).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> ObjectId:
+    try:
+        return ObjectId(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset_query(query: dict, cursor: Optional[str]) -> dict:
+    if cursor:
+        return {**query, "_id": {"$gt": decode_cursor(cursor)}}
+    return query
+
+async def fetch_page(collection, query: dict, projection: dict, limit: int, cursor: Optional[str],
+                     response: Response):
+    docs = await collection.find(keyset_query(query, cursor), {**projection, "_id": 1}) \
+        .sort("_id", ASCENDING).limit(limit + 1).to_list(limit + 1)
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1]["_id"])
+    for doc in docs:
+        del doc["_id"]
+    
+    if FAST_RESPONSES:
+        return json_response(docs, {"X-Next-Cursor": next_cursor} if next_cursor else None)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return docs
+
+def stream_ndjson(collection, query: dict, projection: dict, cursor: Optional[str]) -> StreamingResponse:
+    async def generate():
+        lines = []
+        mongo_cursor = collection.find(keyset_query(query, cursor), projection) \
+            .sort("_id", ASCENDING).batch_size(STREAM_BATCH_SIZE)
+        async for doc in mongo_cursor:
+            lines.append(dumps_json(doc))
+            if len(lines) >= STREAM_BATCH_SIZE:
+                yield b"\n".join(lines) + b"\n"
+                lines = []
+        if lines:
+            yield b"\n".join(lines) + b"\n"
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+# ========== BULK IMPORT ==========
+
+async def iter_lines(chunks):
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8-sig") + "\n"
+        if len(buffer) > IMPORT_MAX_LINE_BYTES:
+            raise HTTPException(status_code=413, detail="Line too long")
+    if buffer:
+        yield buffer.decode("utf-8-sig")
+
+async def iter_jsonl_rows(chunks):
+    row = 0
+    async for line in iter_lines(chunks):
+        row += 1
+        if not line.strip():
+            continue
+        try:
+            yield row, json.loads(line)
+        except ValueError as e:
+            yield row, e
+
+def csv_row_to_question(header: List[str], values: List[str]) -> dict:
+    # Columns: subject_id, difficulty, question_text, explanation, correct_option (1-based), option_1..option_N
+    record = dict(zip(header, values))
+    correct = int(record.get("correct_option") or 0)
+    option_columns = sorted(
+        (column for column in header if column.startswith("option_")), key=lambda column: int(column[7:])
+    )
+    texts = [record[column] for column in option_columns if record.get(column)]
+    return {
+        "subject_id": record.get("subject_id"),
+        "difficulty": record.get("difficulty"),
+        "question_text": record.get("question_text"),
+        "explanation": record.get("explanation", ""),
+        "options": [{"text": text, "is_correct": index == correct} for index, text in enumerate(texts, start=1)],
+    }
+
+async def iter_csv_rows(chunks):
+    header = None
+    row = 0
+    pending = ""
+    async for line in iter_lines(chunks):
+        pending += line
+        # A quoted field may span lines; wait until quotes balance
+        if pending.count('"') % 2:
+            if len(pending) > IMPORT_MAX_LINE_BYTES:
+                raise HTTPException(status_code=413, detail="Line too long")
+            continue
+        record, pending = pending, ""
+        if not record.strip():
+            continue
+        values = next(csv.reader([record]))
+        if header is None:
+            header = [column.strip() for column in values]
+            continue
+        row += 1
+        try:
+            yield row, csv_row_to_question(header, values)
+        except ValueError as e:
+            yield row, e
+
+class QuestionImporter:
+    def __init__(self, created_by: str, subject_ids: set):
+        self.created_by = created_by
+        self.subject_ids = subject_ids
+        self.total_rows = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors: List[ImportRowError] = []
+        self.subject_increments: dict = {}
+        self._chunk: List[tuple] = []
+    
+    def reject(self, row: int, error: str) -> None:
+        self.failed += 1
+        if len(self.errors) < IMPORT_MAX_REPORTED_ERRORS:
+            self.errors.append(ImportRowError(row=row, error=error))
+    
+    async def add(self, row: int, data) -> None:
+        self.total_rows += 1
+        if isinstance(data, Exception):
+            self.reject(row, f"Invalid row: {data}")
+            return
+        try:
+            question_data = QuestionCreate.model_validate(data)
+        except ValidationError as e:
+            self.reject(row, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+            return
+        if question_data.subject_id not in self.subject_ids:
+            self.reject(row, f"Unknown subject_id: {question_data.subject_id}")
+            return
+        
+        question_obj = Question(**question_data.model_dump(), created_by=self.created_by)
+        self._chunk.append((row, question_obj.model_dump()))
+        if len(self._chunk) >= IMPORT_CHUNK_SIZE:
+            await self.flush()
+    
+    async def flush(self) -> None:
+        chunk, self._chunk = self._chunk, []
+        if not chunk:
+            return
+        failed_indexes = set()
+        start = await reserve_ordinals(db, len(chunk))
+        for index, (_, doc) in enumerate(chunk):
+            doc["ordinal"] = start + index
+        try:
+            await db.questions.insert_many([doc for _, doc in chunk], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details["writeErrors"]:
+                failed_indexes.add(error["index"])
+                self.reject(chunk[error["index"]][0], error.get("errmsg", "Write failed"))
+        for index, (_, doc) in enumerate(chunk):
+            if index not in failed_indexes:
+                self.imported += 1
+                self.subject_increments[doc["subject_id"]] = self.subject_increments.get(doc["subject_id"], 0) + 1
+    
+    async def apply_subject_increments(self) -> None:
+        # Counts only inserted chunks and runs once, so it is safe to call again after an aborted upload
+        increments, self.subject_increments = self.subject_increments, {}
+        if increments:
+            await db.subjects.bulk_write([
+                UpdateOne({"id": subject_id}, {"$inc": {"total_questions": count}})
+                for subject_id, count in increments.items()
+            ], ordered=False)
+            subject_catalog.invalidate()
+    
+    async def finish(self) -> ImportReport:
+        await self.flush()
+        await self.apply_subject_increments()
+        return ImportReport(
+            total_rows=self.total_rows,
+            imported=self.imported,
+            failed=self.failed,
+            errors=self.errors,
+            errors_truncated=self.failed > len(self.errors),
+        )
+
+# ========== AI ANALYSIS ==========
+
+AI_SYSTEM_MESSAGE = "Você é um assistente educacional especializado em vestibulares brasileiros. Analise o desempenho do aluno e forneça recomendações práticas e motivadoras."
+
+def empty_analysis() -> AIAnalysisResponse:
+    return AIAnalysisResponse(
+        weak_subjects=[],
+        recommendations="Comece a resolver questões para receber análises personalizadas!",
+        study_plan="Explore as matérias disponíveis e teste seus conhecimentos."
+    )
+
+def fallback_analysis(weak_subjects: List[dict]) -> AIAnalysisResponse:
+    return AIAnalysisResponse(
+        weak_subjects=weak_subjects,
+        recommendations="Foque nas matérias com menor desempenho e pratique questões diariamente.",
+        study_plan="Dedique 30 minutos por dia para cada matéria que precisa melhorar."
+    )
+
+def results_fingerprint(results: List[dict]) -> str:
+    rows = sorted(
+        (r["subject_id"], r["total_questions"], r["correct_answers"], round(r["accuracy"], 4))
+        for r in results
+    )
+    return hashlib.sha1(json.dumps(rows).encode()).hexdigest()
+
+async def find_weak_subjects(results: List[dict]) -> List[dict]:
+    weak_results = [result for result in results if result["accuracy"] < 70]
+    if not weak_results:
+        return []
+    subjects = await db.subjects.find(
+        {"id": {"$in": [result["subject_id"] for result in weak_results]}}, {"_id": 0, "id": 1, "name": 1}
+    ).to_list(None)
+    names = {subject["id"]: subject["name"] for subject in subjects}
+    return [
+        {
+            "name": names[result["subject_id"]],
+            "accuracy": result["accuracy"],
+            "total_questions": result["total_questions"]
+        }
+        for result in weak_results
+        if result["subject_id"] in names
+    ]
+
+def build_analysis_prompt(weak_subjects: List[dict], results: List[dict]) -> str:
+    analysis_data = f"""Análise de desempenho do aluno:
+    
+Matérias com baixo desempenho (abaixo de 70%):
+{chr(10).join([f"- {s['name']}: {s['accuracy']:.1f}% de acerto em {s['total_questions']} questões" for s in weak_subjects])}
+    
+Total de matérias estudadas: {len(results)}
+    """
+    return f"{analysis_data}\n\nCom base nesses dados, forneça:\n1. Recomendações específicas de estudo (2-3 frases)\n2. Um plano de estudos semanal focado (3-4 frases)"
+
+def split_analysis(text: str) -> tuple:
+    # Split at the "2." study-plan item the prompt asks for, else at a sentence boundary
+    text = text.strip()
+    marker = re.search(r"(?m)^[\s*#]*2[.)]", text)
+    if marker and marker.start() > 0:
+        return text[:marker.start()].strip(), text[marker.start():].strip()
+    if len(text) <= 300:
+        return text, "Continue praticando regularmente!"
+    ends = [m.end() for m in re.finditer(r"[.!?](?=\s|$)", text)]
+    cut = max((end for end in ends if end <= 300), default=None) or next((end for end in ends if end < len(text)), len(text))
+    return text[:cut].strip(), text[cut:].strip() or "Continue praticando regularmente!"
+
+def analysis_from_text(weak_subjects: List[dict], text: str) -> AIAnalysisResponse:
+    recommendations, study_plan = split_analysis(text)
+    return AIAnalysisResponse(weak_subjects=weak_subjects, recommendations=recommendations, study_plan=study_plan)
+
+class FakeLlmChat:
+    TEXT = (
+        "1. Revise primeiro os conteúdos das matérias com menor taxa de acerto e refaça as questões que errou. "
+        "Anote os conceitos que geraram dúvida e busque exemplos resolvidos antes de partir para novos exercícios.\n"
+        "2. Na segunda e na quarta, estude teoria das matérias mais fracas. Na terça e na quinta, resolva listas de "
+        "questões. Na sexta, faça um simulado curto e no sábado revise os erros da semana."
+    )
+    
+    def __init__(self, delay: float):
+        self.delay = delay
+    
+    async def send_message(self, message: UserMessage) -> str:
+        await asyncio.sleep(self.delay)
+        return self.TEXT
+    
+    async def stream_message(self, message: UserMessage):
+        tokens = re.findall(r"\S+\s*", self.TEXT)
+        for token in tokens:
+            await asyncio.sleep(self.delay / len(tokens))
+            yield token
+
+def new_analysis_chat(user_id: str):
+    if AI_FAKE_LLM:
+        return FakeLlmChat(AI_FAKE_LLM_DELAY_MS / 1000)
+    return LlmChat(
+        api_key=os.environ['EMERGENT_LLM_KEY'],
+        session_id=f"analysis_{user_id}",
+        system_message=AI_SYSTEM_MESSAGE
+    ).with_model("openai", "gpt-5.2")
+
+def llm_outcome(error: Exception) -> str:
+    return "timeout" if isinstance(error, asyncio.TimeoutError) else "error"
+
+async def run_ai_analysis(user_id: str, results: List[dict], fingerprint: str) -> AIAnalysisResponse:
+    weak_subjects = await find_weak_subjects(results)
+    started = time.perf_counter()
+    try:
+        chat = new_analysis_chat(user_id)
+        response = await asyncio.wait_for(
+            chat.send_message(UserMessage(text=build_analysis_prompt(weak_subjects, results))),
+            timeout=AI_TIMEOUT_SECONDS,
+        )
+    except Exception as e:
+        llm_call_duration.observe(time.perf_counter() - started, "sync", llm_outcome(e))
+        # Fallbacks are not cached so the next request tries the LLM again
+        logging.error(f"AI analysis error: {e!r}")
+        return fallback_analysis(weak_subjects)
+    llm_call_duration.observe(time.perf_counter() - started, "sync", "ok")
+    
+    analysis = analysis_from_text(weak_subjects, response)
+    ai_cache.set(user_id, (fingerprint, analysis))
+    return analysis
+
+# Cached per user and reused while their results rows are unchanged
+ai_cache = TTLCache(AI_CACHE_SIZE, AI_CACHE_TTL_SECONDS)
+# Single-flight: concurrent identical requests share one LLM call
+ai_inflight: dict = {}
+
+async def get_ai_analysis(user_id: str) -> AIAnalysisResponse:
+    results = await db.results.find({"user_id": user_id}, {"_id": 0}).to_list(100)
+    if not results:
+        return empty_analysis()
+    
+    fingerprint = results_fingerprint(results)
+    cached = ai_cache.get(user_id)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+    
+    key = (user_id, fingerprint)
+    task = ai_inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(run_ai_analysis(user_id, results, fingerprint))
+        ai_inflight[key] = task
+        task.add_done_callback(lambda _: ai_inflight.pop(key, None))
+    # Shielded so one caller disconnecting does not cancel the shared call
+    return await asyncio.shield(task)
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def llm_token_stream(chat, message: UserMessage):
+    stream_message = getattr(chat, "stream_message", None)
+    if stream_message is not None:
+        async for token in stream_message(message):
+            yield token
+    else:
+        # The LlmChat integration only hands back complete responses
+        yield await chat.send_message(message)
+
+async def run_ai_stream(user_id: str, results: List[dict], fingerprint: str, weak_subjects: List[dict],
+                        queue: asyncio.Queue) -> AIAnalysisResponse:
+    # Feeds tokens to the stream that started it; the result is shared through ai_inflight like run_ai_analysis
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + AI_TIMEOUT_SECONDS
+    chunks = []
+    tokens = llm_token_stream(
+        new_analysis_chat(user_id), UserMessage(text=build_analysis_prompt(weak_subjects, results))
+    )
+    started = time.perf_counter()
+    try:
+        while True:
+            try:
+                token = await asyncio.wait_for(tokens.__anext__(), timeout=deadline - loop.time())
+            except StopAsyncIteration:
+                break
+            chunks.append(token)
+            queue.put_nowait(token)
+    except Exception as e:
+        llm_call_duration.observe(time.perf_counter() - started, "stream", llm_outcome(e))
+        logging.error(f"AI analysis stream error: {e!r}")
+        await tokens.aclose()
+        return fallback_analysis(weak_subjects)
+    finally:
+        queue.put_nowait(None)
+    
+    llm_call_duration.observe(time.perf_counter() - started, "stream", "ok")
+    analysis = analysis_from_text(weak_subjects, "".join(chunks))
+    ai_cache.set(user_id, (fingerprint, analysis))
+    return analysis
+
+async def stream_ai_analysis(user_id: str):
+    results = await db.results.find({"user_id": user_id}, {"_id": 0}).to_list(100)
+    if not results:
+        analysis = empty_analysis()
+        yield sse_event("weak_subjects", analysis.weak_subjects)
+        yield sse_event("done", analysis.model_dump())
+        return
+    
+    weak_subjects = await find_weak_subjects(results)
+    yield sse_event("weak_subjects", weak_subjects)
+    
+    fingerprint = results_fingerprint(results)
+    cached = ai_cache.get(user_id)
+    if cached is not None and cached[0] == fingerprint:
+        yield sse_event("done", cached[1].model_dump())
+        return
+    
+    key = (user_id, fingerprint)
+    task = ai_inflight.get(key)
+    if task is None:
+        queue = asyncio.Queue()
+        task = asyncio.create_task(run_ai_stream(user_id, results, fingerprint, weak_subjects, queue))
+        ai_inflight[key] = task
+        task.add_done_callback(lambda _: ai_inflight.pop(key, None))
+        while True:
+            token = await queue.get()
+            if token is None:
+                break
+            yield sse_event("token", token)
+    # Joining an in-flight call (sync or streamed) skips straight to its result; shielded so a
+    # disconnecting client does not cancel the call the others are waiting on
+    analysis = await asyncio.shield(task)
+    yield sse_event("done", analysis.model_dump())
+
+async def expire_stale_job(job: dict) -> bool:
+    # Fails an active job whose lease lapsed because its worker died; returns True if it did
+    lease_until = job.get("lease_until")
+    if lease_until is not None and lease_until.replace(tzinfo=timezone.utc) > datetime.now(timezone.utc):
+        return False
+    now = datetime.now(timezone.utc).isoformat()
+    await db.ai_jobs.update_one(
+        {"id": job["id"], "status": job["status"], "lease_until": lease_until},
+        {"$set": {"status": "failed", "error": "worker lost", "updated_at": now},
+         "$unset": {"active": "", "lease_until": ""}}
+    )
+    job.update(status="failed", error="worker lost", updated_at=now)
+    return True
+
+class AIJobQueue:
+    def __init__(self, workers: int, queue_limit: int):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._queue: Optional[asyncio.Queue] = None
+        # Queue slots promised to submits still inserting their job, so concurrent submits cannot overfill it
+        self._reserved = 0
+        self._tasks: List[asyncio.Task] = []
+        # Jobs owned by this process, so long-polls can wake up without hitting the DB
+        self._events: dict = {}
+    
+    def start(self) -> None:
+        self._queue = asyncio.Queue(maxsize=self.queue_limit)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+    
+    async def submit(self, user_id: str) -> dict:
+        active = await self.active_job(user_id)
+        if active:
+            return active
+        if self._queue is None or self._queue.qsize() + self._reserved >= self.queue_limit:
+            raise HTTPException(status_code=503, detail="Analysis queue is full, please retry")
+        self._reserved += 1
+        try:
+            return await self._enqueue(user_id)
+        finally:
+            self._reserved -= 1
+    
+    async def _enqueue(self, user_id: str) -> dict:
+        now = datetime.now(timezone.utc)
+        job = {
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "status": "queued",
+            "result": None,
+            "error": None,
+            "created_at": now.isoformat(),
+            "updated_at": now.isoformat(),
+            "expires_at": now + timedelta(seconds=AI_JOB_TTL_SECONDS),
+            "active": True,
+            "lease_until": now + timedelta(seconds=AI_JOB_LEASE_SECONDS),
+        }
+        try:
+            await db.ai_jobs.insert_one(job)
+        except DuplicateKeyError:
+            # A concurrent submit (double click) created the user's active job first
+            active = await self.active_job(user_id)
+            if active:
+                return active
+            raise HTTPException(status_code=409, detail="Analysis already in progress, please retry")
+        job.pop("_id", None)
+        self._events[job["id"]] = asyncio.Event()
+        try:
+            self._queue.put_nowait(job)
+        except BaseException:
+            # Never leave an active job behind that no worker will run; the heartbeat would renew it forever
+            self._events.pop(job["id"], None)
+            await self._set_status(job["id"], {"status": "failed", "error": "could not be queued"})
+            raise
+        return job
+    
+    async def active_job(self, user_id: str) -> Optional[dict]:
+        job = await db.ai_jobs.find_one({"user_id": user_id, "active": True}, {"_id": 0})
+        if job is None or not await expire_stale_job(job):
+            return job
+        return None
+    
+    async def wait(self, job_id: str, timeout: float) -> None:
+        event = self._events.get(job_id)
+        if event is not None:
+            try:
+                await asyncio.wait_for(event.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+        else:
+            await asyncio.sleep(timeout)
+    
+    async def _set_status(self, job_id: str, fields: dict) -> None:
+        update = {"$set": {**fields, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        if fields["status"] in ("done", "failed"):
+            update["$unset"] = {"active": "", "lease_until": ""}
+        await db.ai_jobs.update_one(
+            {"id": job_id},
+            update
+        )
+    
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._set_status(job["id"], {"status": "running"})
+                analysis = await get_ai_analysis(job["user_id"])
+                await self._set_status(job["id"], {"status": "done", "result": analysis.model_dump()})
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"AI job {job['id']} failed: {e!r}")
+                await self._set_status(job["id"], {"status": "failed", "error": "analysis failed"})
+            finally:
+                event = self._events.pop(job["id"], None)
+                if event is not None:
+                    event.set()
+                self._queue.task_done()
+    
+    async def _heartbeat(self) -> None:
+        # Renew the lease on every job this process owns (queued here or running)
+        while True:
+            await asyncio.sleep(AI_JOB_LEASE_SECONDS / 3)
+            if not self._events:
+                continue
+            try:
+                await db.ai_jobs.update_many(
+                    {"id": {"$in": list(self._events)}, "active": True},
+                    {"$set": {"lease_until": datetime.now(timezone.utc) + timedelta(seconds=AI_JOB_LEASE_SECONDS)}}
+                )
+            except Exception as e:
+                logger.error(f"AI job lease renewal failed: {e!r}")
+    
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Whatever this process still owned will never finish
+        if self._events:
+            await db.ai_jobs.update_many(
+                {"id": {"$in": list(self._events)}, "active": True},
+                {"$set": {"status": "failed", "error": "server shutting down",
+                          "updated_at": datetime.now(timezone.utc).isoformat()},
+                 "$unset": {"active": "", "lease_until": ""}}
+            )
+            self._events.clear()
+
+ai_jobs = AIJobQueue(AI_JOB_WORKERS, AI_JOB_QUEUE_LIMIT)
+
 # ========== ROUTES ==========
 
 @api_router.get("/")
 async def root():
     return {"message": "StudyHub FB API"}
 
+# HEALTH ROUTES
+@api_router.get("/health/live")
+async def liveness():
+    return {"status": "ok"}
+
+@api_router.get("/health/ready")
+async def readiness():
+    if not app.state.ready:
+        raise HTTPException(status_code=503, detail="Not ready")
+    try:
+        await asyncio.wait_for(db.command("ping"), timeout=1)
+    except Exception:
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    return {"status": "ready"}
+
 # AUTH ROUTES
-@api_router.post("/auth/register", response_model=TokenResponse)
+@api_router.post("/auth/register", response_model=TokenResponse,
+                 dependencies=[Depends(admit_by_ip(register_admission))])
 async def register(user_data: UserCreate):
     existing = await db.users.find_one({"email": user_data.email}, {"_id": 0})
     if existing:
@@ -187,14 +2426,19 @@ async def register(user_data: UserCreate):
         "id": str(uuid.uuid4()),
         "name": user_data.name,
         "email": user_data.email,
-        "password_hash": hash_password(user_data.password),
-        "role": user_data.role,
+        "password_hash": await hash_password(user_data.password),
+        # Self-registration always creates students; teachers/admins are promoted with scripts/set_role.py
+        "role": "student",
         "avatar": None,
         "weekly_goal": 50,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     
-    await db.users.insert_one(user_dict)
+    try:
+        await db.users.insert_one(user_dict)
+    except DuplicateKeyError:
+        # Lost a race with a concurrent registration of the same email
+        raise HTTPException(status_code=400, detail="Email already registered")
     
     access_token = create_access_token(data={"sub": user_dict["id"]})
     user_response = UserResponse(
@@ -213,11 +2457,20 @@ async def register(user_data: UserCreate):
         user=user_response
     )
 
-@api_router.post("/auth/login", response_model=TokenResponse)
+@api_router.post("/auth/login", response_model=TokenResponse,
+                 dependencies=[Depends(admit_by_ip(login_admission))])
 async def login(credentials: UserLogin):
+    if RATE_LIMIT_ENABLED:
+        login_email_admission.check_rate(credentials.email.strip().lower())
     user = await db.users.find_one({"email": credentials.email}, {"_id": 0})
-    if not user or not verify_password(credentials.password, user["password_hash"]):
+    if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    valid, new_hash = await verify_password(credentials.password, user["password_hash"])
+    if not valid:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        await db.users.update_one({"id": user["id"]}, {"$set": {"password_hash": new_hash}})
+        user_cache.invalidate(user["id"])
     
     access_token = create_access_token(data={"sub": user["id"]})
     user_response = UserResponse(
@@ -247,12 +2500,16 @@ async def create_subject(subject_data: SubjectCreate, current_user: dict = Depen
     subject_obj = Subject(**subject_dict)
     doc = subject_obj.model_dump()
     await db.subjects.insert_one(doc)
+    subject_catalog.invalidate()
     return subject_obj
 
 @api_router.get("/subjects", response_model=List[Subject])
-async def get_subjects():
-    subjects = await db.subjects.find({}, {"_id": 0}).to_list(100)
-    return subjects
+async def get_subjects(request: Request):
+    body, etag = await subject_catalog.get()
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 # QUESTION ROUTES
 @api_router.post("/questions", response_model=Question)
@@ -260,43 +2517,113 @@ async def create_question(question_data: QuestionCreate, current_user: dict = De
     question_dict = question_data.model_dump()
     question_dict["created_by"] = current_user["id"]
     question_obj = Question(**question_dict)
-    doc = question_obj.model_dump()
-    await db.questions.insert_one(doc)
+    doc = {**question_obj.model_dump(), "ordinal": await reserve_ordinals(db, 1)}
+    # insert_one adds _id to the dict it is given; only cache once the question really exists
+    await db.questions.insert_one(dict(doc))
+    question_cache.set(question_obj.id, doc)
     
     # Update subject total questions
     await db.subjects.update_one(
         {"id": question_data.subject_id},
         {"$inc": {"total_questions": 1}}
     )
+    subject_catalog.invalidate()
     
     return question_obj
 
+@api_router.post("/questions/import", response_model=ImportReport)
+async def import_questions(
+    request: Request,
+    format: str = Query("jsonl", pattern="^(jsonl|csv)$"),
+    current_user: dict = Depends(require_role("teacher", "admin")),
+):
+    # The body is read as a stream, so memory stays bounded by IMPORT_CHUNK_SIZE
+    subjects = await db.subjects.find({}, {"_id": 0, "id": 1}).to_list(None)
+    importer = QuestionImporter(current_user["id"], {subject["id"] for subject in subjects})
+    rows = iter_csv_rows(request.stream()) if format == "csv" else iter_jsonl_rows(request.stream())
+    try:
+        async for row, data in rows:
+            await importer.add(row, data)
+        return await importer.finish()
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="File must be UTF-8 encoded")
+    finally:
+        # A 413, bad encoding or client disconnect after some chunks were inserted must still count them
+        await importer.apply_subject_increments()
+
 @api_router.get("/questions", response_model=List[Question])
-async def get_questions(subject_id: Optional[str] = None, difficulty: Optional[str] = None):
+async def get_questions(
+    response: Response,
+    subject_id: Optional[str] = None,
+    difficulty: Optional[str] = None,
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+):
     query = {}
     if subject_id:
         query["subject_id"] = subject_id
     if difficulty:
         query["difficulty"] = difficulty
     
-    questions = await db.questions.find(query, {"_id": 0}).to_list(1000)
+    if stream:
+        return stream_ndjson(db.questions, query, QUESTION_PROJECTION, cursor)
+    return await fetch_page(db.questions, query, QUESTION_PROJECTION, limit, cursor, response)
+
+@api_router.get("/questions/next", response_model=List[Question])
+async def get_next_questions(
+    count: int = Query(10, ge=1, le=100),
+    subject_id: Optional[str] = None,
+    difficulty: Optional[str] = None,
+    current_user: dict = Depends(get_current_user),
+):
+    questions = await select_next_questions(current_user["id"], count, subject_id, difficulty)
+    if FAST_RESPONSES:
+        return json_response(questions)
     return questions
 
+@api_router.get("/questions/search", response_model=List[QuestionSearchHit])
+async def search_questions(
+    q: str = Query(..., min_length=2, max_length=200),
+    subject_id: Optional[str] = None,
+    difficulty: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=MAX_PAGE_SIZE),
+):
+    query = {"$text": {"$search": q}}
+    if subject_id:
+        query["subject_id"] = subject_id
+    if difficulty:
+        query["difficulty"] = difficulty
+    
+    score = {"$meta": "textScore"}
+    hits = await db.questions.find(query, {**QUESTION_PROJECTION, "score": score}) \
+        .sort([("score", score), ("_id", ASCENDING)]).skip(offset).limit(limit).to_list(limit)
+    if FAST_RESPONSES:
+        return json_response(hits)
+    return hits
+
 @api_router.get("/questions/{question_id}", response_model=Question)
 async def get_question(question_id: str):
-    question = await db.questions.find_one({"id": question_id}, {"_id": 0})
+    question = await get_question_doc(question_id)
     if not question:
         raise HTTPException(status_code=404, detail="Question not found")
+    if FAST_RESPONSES:
+        # The cached document also carries internal fields such as the ordinal
+        return json_response({field: question[field] for field in QUESTION_PROJECTION if field in question})
     return question
 
 # ANSWER ROUTES
 @api_router.post("/answers", response_model=Answer)
 async def submit_answer(answer_data: AnswerSubmit, current_user: dict = Depends(get_current_user)):
-    question = await db.questions.find_one({"id": answer_data.question_id}, {"_id": 0})
+    question = await get_question_doc(answer_data.question_id)
     if not question:
         raise HTTPException(status_code=404, detail="Question not found")
+    if not 0 <= answer_data.selected_option < len(question["options"]):
+        raise HTTPException(status_code=400, detail="Invalid option")
     
     is_correct = question["options"][answer_data.selected_option]["is_correct"]
+    answered_at = datetime.now(timezone.utc)
     
     answer_dict = {
         "id": str(uuid.uuid4()),
@@ -304,163 +2631,349 @@ async def submit_answer(answer_data: AnswerSubmit, current_user: dict = Depends(
         "question_id": answer_data.question_id,
         "selected_option": answer_data.selected_option,
         "is_correct": is_correct,
-        "answered_at": datetime.now(timezone.utc).isoformat(),
+        "answered_at": answered_at.isoformat(),
         "time_spent": answer_data.time_spent
     }
     
+    answer = Answer(**answer_dict)
+    
+    if answer_buffer is not None:
+        await answer_buffer.add(answer_dict, question, current_user["name"])
+        return answer
+    
     await db.answers.insert_one(answer_dict)
     
-    # Update or create result
-    result = await db.results.find_one(
-        {"user_id": current_user["id"], "subject_id": question["subject_id"]},
-        {"_id": 0}
+    # Update or create result, leaderboard and ranking buckets atomically (no lost increments)
+    correct = 1 if is_correct else 0
+    await asyncio.gather(
+        apply_result_delta(current_user["id"], question["subject_id"], 1, correct),
+        apply_leaderboard_delta(current_user["id"], current_user["name"], 1, correct),
+        apply_ranking_bucket_deltas(
+            current_user["id"], current_user["name"], question["subject_id"], answered_at, 1, correct
+        ),
+        mark_answered(current_user["id"], [question.get("ordinal")]),
+        bulk_upsert(db.study_days, [study_day_update(
+            current_user["id"], study_day(answered_at),
+            {question["subject_id"]: [1, correct, answer_data.time_spent]},
+        )]),
+        apply_item_stats(question, answer_dict),
     )
     
-    if result:
-        new_total = result["total_questions"] + 1
-        new_correct = result["correct_answers"] + (1 if is_correct else 0)
-        new_accuracy = (new_correct / new_total) * 100
-        
-        await db.results.update_one(
-            {"id": result["id"]},
-            {"$set": {
-                "total_questions": new_total,
-                "correct_answers": new_correct,
-                "accuracy": new_accuracy,
-                "last_updated": datetime.now(timezone.utc).isoformat()
-            }}
-        )
-    else:
-        result_dict = {
+    return answer
+
+@api_router.post("/answers/batch", response_model=AnswerBatchResult)
+async def submit_answer_batch(batch: AnswerBatchSubmit, current_user: dict = Depends(get_current_user)):
+    questions = await get_question_docs([item.question_id for item in batch.answers])
+    answered_at = datetime.now(timezone.utc)
+    
+    items = []
+    graded = []
+    for item in batch.answers:
+        question = questions.get(item.question_id)
+        if question is None:
+            items.append({"question_id": item.question_id, "status": "not_found"})
+            continue
+        if not 0 <= item.selected_option < len(question["options"]):
+            items.append({"question_id": item.question_id, "status": "invalid_option"})
+            continue
+        answer_dict = {
             "id": str(uuid.uuid4()),
             "user_id": current_user["id"],
-            "subject_id": question["subject_id"],
-            "total_questions": 1,
-            "correct_answers": 1 if is_correct else 0,
-            "accuracy": 100.0 if is_correct else 0.0,
-            "last_updated": datetime.now(timezone.utc).isoformat()
+            "question_id": item.question_id,
+            "selected_option": item.selected_option,
+            "is_correct": question["options"][item.selected_option]["is_correct"],
+            "answered_at": answered_at.isoformat(),
+            "time_spent": item.time_spent
         }
-        await db.results.insert_one(result_dict)
+        items.append({"question_id": item.question_id, "status": "graded", "answer": dict(answer_dict)})
+        graded.append((answer_dict, question))
+    
+    correct_total = sum(1 for answer_dict, _ in graded if answer_dict["is_correct"])
+    body = {"answered": len(graded), "correct": correct_total, "items": items}
+    if not graded:
+        return body
+    
+    if answer_buffer is not None:
+        await answer_buffer.add_many([
+            (answer_dict, question, current_user["name"]) for answer_dict, question in graded
+        ])
+        return body
     
-    return Answer(**answer_dict)
+    await db.answers.insert_many([answer_dict for answer_dict, _ in graded])
+    
+    # One delta per subject and per ranking board instead of one write per answer
+    subject_deltas: dict = {}
+    for answer_dict, question in graded:
+        add_study_delta(subject_deltas, question["subject_id"], 1 if answer_dict["is_correct"] else 0,
+                        answer_dict["time_spent"])
+    item_deltas: dict = {}
+    for answer_dict, question in graded:
+        add_item_delta(item_deltas, question, answer_dict)
+    bucket_deltas: dict = {}
+    for subject_id, (answered, correct, _) in subject_deltas.items():
+        for board, expires_at in ranking_boards(subject_id, answered_at):
+            bucket_delta = bucket_deltas.setdefault(board, [expires_at, 0, 0])
+            bucket_delta[1] += answered
+            bucket_delta[2] += correct
+    
+    user_id, name = current_user["id"], current_user["name"]
+    await asyncio.gather(
+        bulk_upsert(db.results, [
+            ({"user_id": user_id, "subject_id": subject_id}, result_delta_pipeline(answered, correct))
+            for subject_id, (answered, correct, _) in subject_deltas.items()
+        ]),
+        apply_leaderboard_delta(user_id, name, len(graded), correct_total),
+        bulk_upsert(db.ranking_buckets, [
+            ranking_bucket_update(board, user_id, name, expires_at, answered, correct)
+            for board, (expires_at, answered, correct) in bucket_deltas.items()
+        ]),
+        mark_answered(user_id, [question.get("ordinal") for _, question in graded]),
+        bulk_upsert(db.study_days, [study_day_update(user_id, study_day(answered_at), subject_deltas)]),
+        bulk_upsert(db.question_stats, item_stats_updates(item_deltas)),
+    )
+    
+    return body
 
 @api_router.get("/answers/my-answers", response_model=List[Answer])
-async def get_my_answers(current_user: dict = Depends(get_current_user)):
-    answers = await db.answers.find({"user_id": current_user["id"]}, {"_id": 0}).to_list(1000)
-    return answers
+async def get_my_answers(
+    response: Response,
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    current_user: dict = Depends(get_current_user),
+):
+    query = {"user_id": current_user["id"]}
+    if stream:
+        return stream_ndjson(db.answers, query, ANSWER_PROJECTION, cursor)
+    return await fetch_page(db.answers, query, ANSWER_PROJECTION, limit, cursor, response)
 
 # RESULTS ROUTES
 @api_router.get("/results", response_model=List[Result])
 async def get_results(current_user: dict = Depends(get_current_user)):
-    results = await db.results.find({"user_id": current_user["id"]}, {"_id": 0}).to_list(100)
+    results = await db.results.find({"user_id": current_user["id"]}, RESULT_PROJECTION).to_list(100)
+    if FAST_RESPONSES:
+        return json_response(results)
     return results
 
-# RANKING ROUTE
+# PROGRESS ROUTES
+@api_router.get("/progress/weekly", response_model=WeeklyProgress)
+async def get_weekly_progress(current_user: dict = Depends(get_current_user)):
+    today = study_today()
+    week_start = today - timedelta(days=today.weekday())
+    days = fill_study_days(await load_study_days(current_user["id"], week_start.isoformat()), week_start, 7)
+    
+    answered = sum(day["answered"] for day in days)
+    correct = sum(day["correct"] for day in days)
+    goal = current_user.get("weekly_goal", 50)
+    return {
+        "week_start": week_start.isoformat(),
+        "weekly_goal": goal,
+        "answered": answered,
+        "correct": correct,
+        "accuracy": correct / answered * 100 if answered else 0.0,
+        "time_spent": sum(day["time_spent"] for day in days),
+        "remaining": max(goal - answered, 0),
+        "goal_reached": answered >= goal,
+        "days": days,
+    }
+
+@api_router.get("/progress/streak", response_model=StudyStreak)
+async def get_study_streak(current_user: dict = Depends(get_current_user)):
+    today = study_today()
+    first_day = (today - timedelta(days=STREAK_LOOKBACK_DAYS - 1)).isoformat()
+    # Covered by user_day_unique: reads index keys only, newest first
+    days = await db.study_days.find(
+        {"user_id": current_user["id"], "day": {"$gte": first_day}}, {"_id": 0, "day": 1}
+    ).sort("day", DESCENDING).to_list(STREAK_LOOKBACK_DAYS)
+    return compute_streaks([day["day"] for day in days], today.isoformat())
+
+@api_router.get("/progress/timeseries", response_model=List[StudyDay])
+async def get_study_timeseries(
+    days: int = Query(30, ge=1, le=MAX_TIMESERIES_DAYS),
+    current_user: dict = Depends(get_current_user),
+):
+    first = study_today() - timedelta(days=days - 1)
+    return fill_study_days(await load_study_days(current_user["id"], first.isoformat()), first, days)
+
+# RANKING ROUTES
+def ranking_source(subject_id: Optional[str], window: Optional[str]) -> tuple:
+    if not subject_id and not window:
+        return db.leaderboard, {}
+    board = ranking_board(subject_id, window, datetime.now(timezone.utc))
+    return db.ranking_buckets, {"board": board}
+
 @api_router.get("/ranking", response_model=List[RankingUser])
-async def get_ranking():
-    pipeline = [
-        {
-            "$group": {
-                "_id": "$user_id",
-                "total_questions": {"$sum": "$total_questions"},
-                "correct_answers": {"$sum": "$correct_answers"}
-            }
-        },
-        {
-            "$project": {
-                "user_id": "$_id",
-                "total_questions": 1,
-                "correct_answers": 1,
-                "accuracy": {
-                    "$multiply": [
-                        {"$divide": ["$correct_answers", "$total_questions"]},
-                        100
-                    ]
-                }
-            }
-        },
-        {"$sort": {"correct_answers": -1}},
-        {"$limit": 10}
+async def get_ranking(
+    limit: int = Query(10, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    subject_id: Optional[str] = None,
+    window: Optional[str] = Query(None, pattern="^(week|month)$"),
+):
+    collection, query = ranking_source(subject_id, window)
+    entries = await collection.find(query, {"_id": 0}) \
+        .sort(LEADERBOARD_SORT).skip(offset).limit(limit).to_list(limit)
+    return [
+        RankingUser(
+            name=entry["name"],
+            total_questions=entry["total_questions"],
+            correct_answers=entry["correct_answers"],
+            accuracy=round(entry["accuracy"], 2)
+        )
+        for entry in entries
     ]
+
+@api_router.get("/ranking/me", response_model=RankingPosition)
+async def get_my_ranking(
+    subject_id: Optional[str] = None,
+    window: Optional[str] = Query(None, pattern="^(week|month)$"),
+    current_user: dict = Depends(get_current_user),
+):
+    collection, query = ranking_source(subject_id, window)
+    entry = await collection.find_one({**query, "user_id": current_user["id"]}, {"_id": 0})
+    if not entry:
+        return RankingPosition()
     
-    ranking_data = await db.results.aggregate(pipeline).to_list(10)
-    
-    ranking_users = []
-    for item in ranking_data:
-        user = await db.users.find_one({"id": item["user_id"]}, {"_id": 0, "name": 1})
-        if user:
-            ranking_users.append(RankingUser(
-                name=user["name"],
-                total_questions=item["total_questions"],
-                correct_answers=item["correct_answers"],
-                accuracy=round(item["accuracy"], 2)
-            ))
-    
-    return ranking_users
+    # Everyone sorted ahead of us in LEADERBOARD_SORT order
+    ahead = await collection.count_documents({**query, "$or": [
+        {"correct_answers": {"$gt": entry["correct_answers"]}},
+        {"correct_answers": entry["correct_answers"], "user_id": {"$lt": current_user["id"]}},
+    ]})
+    return RankingPosition(
+        position=ahead + 1,
+        total_questions=entry["total_questions"],
+        correct_answers=entry["correct_answers"],
+        accuracy=round(entry["accuracy"], 2)
+    )
 
 # AI ANALYSIS ROUTE
-@api_router.post("/ai/analyze", response_model=AIAnalysisResponse)
+@api_router.post("/ai/analyze", response_model=AIAnalysisResponse,
+                 dependencies=[Depends(admit_by_user(ai_admission))])
 async def ai_analysis(request: AIAnalysisRequest, current_user: dict = Depends(get_current_user)):
     if request.user_id != current_user["id"]:
         raise HTTPException(status_code=403, detail="Forbidden")
-    
-    # Get user results
-    results = await db.results.find({"user_id": request.user_id}, {"_id": 0}).to_list(100)
-    
-    if not results:
-        return AIAnalysisResponse(
-            weak_subjects=[],
-            recommendations="Comece a resolver questões para receber análises personalizadas!",
-            study_plan="Explore as matérias disponíveis e teste seus conhecimentos."
-        )
-    
-    # Get subjects data
-    weak_subjects = []
-    for result in results:
-        if result["accuracy"] < 70:
-            subject = await db.subjects.find_one({"id": result["subject_id"]}, {"_id": 0})
-            if subject:
-                weak_subjects.append({
-                    "name": subject["name"],
-                    "accuracy": result["accuracy"],
-                    "total_questions": result["total_questions"]
-                })
-    
-    # Prepare AI prompt
-    analysis_data = f"""Análise de desempenho do aluno:
-    
-Matérias com baixo desempenho (abaixo de 70%):
-{chr(10).join([f"- {s['name']}: {s['accuracy']:.1f}% de acerto em {s['total_questions']} questões" for s in weak_subjects])}
-    
-Total de matérias estudadas: {len(results)}
-    """
-    
-    # Call AI
-    try:
-        chat = LlmChat(
-            api_key=os.environ['EMERGENT_LLM_KEY'],
-            session_id=f"analysis_{request.user_id}",
-            system_message="Você é um assistente educacional especializado em vestibulares brasileiros. Analise o desempenho do aluno e forneça recomendações práticas e motivadoras."
-        ).with_model("openai", "gpt-5.2")
-        
-        user_message = UserMessage(
-            text=f"{analysis_data}\n\nCom base nesses dados, forneça:\n1. Recomendações específicas de estudo (2-3 frases)\n2. Um plano de estudos semanal focado (3-4 frases)"
-        )
-        
-        response = await chat.send_message(user_message)
-        
-        return AIAnalysisResponse(
-            weak_subjects=weak_subjects,
-            recommendations=response[:300] if len(response) > 300 else response,
-            study_plan=response[300:] if len(response) > 300 else "Continue praticando regularmente!"
-        )
-    except Exception as e:
-        logging.error(f"AI analysis error: {e}")
-        return AIAnalysisResponse(
-            weak_subjects=weak_subjects,
-            recommendations="Foque nas matérias com menor desempenho e pratique questões diariamente.",
-            study_plan="Dedique 30 minutos por dia para cada matéria que precisa melhorar."
-        )
+    return await get_ai_analysis(request.user_id)
+
+@api_router.post("/ai/analyze/stream", dependencies=[Depends(rate_limit_by_user(ai_admission))])
+async def ai_analysis_stream(request: AIAnalysisRequest, current_user: dict = Depends(get_current_user)):
+    if request.user_id != current_user["id"]:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return StreamingResponse(
+        admitted_stream(ai_admission, stream_ai_analysis(request.user_id)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@api_router.post("/ai/analyze/jobs", response_model=AIJob, status_code=202,
+                 dependencies=[Depends(admit_by_user(ai_admission))])
+async def submit_ai_analysis_job(request: AIAnalysisRequest, current_user: dict = Depends(get_current_user)):
+    if request.user_id != current_user["id"]:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return await ai_jobs.submit(request.user_id)
+
+@api_router.get("/ai/analyze/jobs/{job_id}", response_model=AIJob)
+async def get_ai_analysis_job(
+    job_id: str,
+    wait: float = Query(0, ge=0),
+    current_user: dict = Depends(get_current_user),
+):
+    # Long-poll: hold the request until the job finishes or `wait` seconds pass
+    deadline = time.monotonic() + min(wait, AI_JOB_MAX_WAIT_SECONDS)
+    while True:
+        job = await db.ai_jobs.find_one({"id": job_id, "user_id": current_user["id"]}, {"_id": 0})
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        remaining = deadline - time.monotonic()
+        if job["status"] in ("queued", "running") and await expire_stale_job(job):
+            return job
+        if job["status"] in ("done", "failed") or remaining <= 0:
+            return job
+        await ai_jobs.wait(job_id, min(remaining, 0.5))
+
+# ITEM STATISTICS ROUTES
+@api_router.get("/item-stats", response_model=List[ItemStats])
+async def list_item_stats(
+    subject_id: Optional[str] = None,
+    mismatched: bool = False,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    current_user: dict = Depends(require_role("teacher", "admin")),
+):
+    query = {}
+    if subject_id:
+        query["subject_id"] = subject_id
+    if mismatched:
+        # Calibrated questions whose suggested label disagrees with the hand-set one
+        query["suggested_difficulty"] = {"$exists": True}
+        query["$expr"] = {"$ne": ["$suggested_difficulty", "$difficulty"]}
+    docs = await db.question_stats.find(query, {"_id": 0}) \
+        .sort([("attempts", DESCENDING), ("question_id", ASCENDING)]).skip(offset).limit(limit).to_list(limit)
+    stats = [item_stats_view(doc) for doc in docs]
+    if FAST_RESPONSES:
+        return json_response(stats)
+    return stats
+
+@api_router.get("/item-stats/{question_id}", response_model=ItemStats)
+async def get_item_stats(question_id: str, current_user: dict = Depends(require_role("teacher", "admin"))):
+    doc = await db.question_stats.find_one({"question_id": question_id}, {"_id": 0})
+    if not doc:
+        raise HTTPException(status_code=404, detail="No answers recorded for this question")
+    return item_stats_view(doc)
+
+@api_router.post("/item-stats/recalibrate", response_model=CalibrationSummary)
+async def recalibrate_item_stats(current_user: dict = Depends(require_role("teacher", "admin"))):
+    return await recalibrate_item_difficulty(db)
+
+# ADMIN ROUTES
+@api_router.get("/admin/indexes")
+async def get_index_usage(current_user: dict = Depends(require_role("admin"))):
+    return await index_usage_report(db)
+
+@api_router.get("/admin/caches")
+async def get_cache_stats(current_user: dict = Depends(require_role("admin"))):
+    return {"questions": question_cache.stats(), "users": user_cache.stats(), "ai_analysis": ai_cache.stats()}
+
+@api_router.get("/admin/admission")
+async def get_admission_stats(current_user: dict = Depends(require_role("admin"))):
+    return {policy.name: policy.stats() for policy in ADMISSION_POLICIES}
+
+@api_router.post("/admin/leaderboard/rebuild")
+async def rebuild_leaderboard_route(current_user: dict = Depends(require_role("admin"))):
+    await rebuild_leaderboard(db)
+    return {"status": "ok"}
+
+# METRICS ROUTE
+register_metric(Gauge(
+    "studyhub_cache_events_total", "In-process cache hits and misses", ("cache", "result"), kind="counter",
+    collect=lambda: {
+        (name, result): stats[result]
+        for name, stats in (("questions", question_cache.stats()), ("users", user_cache.stats()),
+                            ("ai_analysis", ai_cache.stats()))
+        for result in ("hits", "misses")
+    },
+))
+register_metric(Gauge(
+    "studyhub_password_hash_jobs", "bcrypt jobs pending in the hashing pool", (),
+    collect=lambda: {(): hash_executor.pending},
+))
+register_metric(Gauge(
+    "studyhub_password_hash_rejected_total", "bcrypt jobs rejected with 503", (), kind="counter",
+    collect=lambda: {(): hash_executor.rejected},
+))
+
+register_metric(Gauge(
+    "studyhub_admission_shed_total", "Requests rejected by admission control", ("policy", "reason"), kind="counter",
+    collect=lambda: {
+        (policy.name, reason): count for policy in ADMISSION_POLICIES for reason, count in policy.shed.items()
+    },
+))
+register_metric(Gauge(
+    "studyhub_admission_in_flight", "Requests admitted and still running", ("policy",),
+    collect=lambda: {(policy.name,): policy.in_flight for policy in ADMISSION_POLICIES},
+))
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -471,7 +2984,9 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+app.add_middleware(MetricsMiddleware)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -479,6 +2994,50 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
+async def startup_db_client():
+    global client, db
+    client = create_mongo_client()
+    db = client[os.environ['DB_NAME']]
+    
+    try:
+        await ensure_indexes(db)
+    except Exception as e:
+        logger.error(f"Index provisioning failed: {e}")
+        raise
+    
+    # Derived collections are backfilled by scripts/backfill.py, never here: every worker runs startup
+    # at once, and a rebuild finishing after another worker started taking answers would overwrite them
+    if await db.answers.estimated_document_count() > 0:
+        empty = [
+            name for name in ("answered_sets", "leaderboard", "question_stats", "study_days")
+            if await db[name].estimated_document_count() == 0
+        ]
+        if empty:
+            logger.warning(f"Derived collections are empty: {', '.join(empty)}; run python scripts/backfill.py")
+    
+    global answer_buffer
+    if ANSWER_WRITE_BEHIND:
+        answer_buffer = AnswerWriteBuffer(
+            db, ANSWER_BATCH_SIZE, ANSWER_FLUSH_INTERVAL_MS / 1000, ANSWER_MAX_PENDING
+        )
+        answer_buffer.start()
+    
+    ai_jobs.start()
+    item_calibrator.start()
+    
+    # Warm up: open minPoolSize connections and load the subject catalog before taking traffic
+    await asyncio.gather(*[db.command("ping") for _ in range(max(MONGO_MIN_POOL_SIZE, 1))])
+    await subject_catalog.get()
+    app.state.ready = True
+    logger.info(f"Worker {os.getpid()} ready")
+
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    # Fail readiness first so the load balancer drains this worker
+    app.state.ready = False
+    if answer_buffer is not None:
+        await answer_buffer.close()
+    await ai_jobs.close()
+    await item_calibrator.close()
+    hash_executor.shutdown()
+    if client is not None:
+        client.close()
\ No newline at end of file
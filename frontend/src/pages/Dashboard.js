@@ -11,6 +11,7 @@ import NavBar from '@/components/NavBar';
 const Dashboard = ({ user, onLogout }) => {
   const [results, setResults] = useState([]);
   const [subjects, setSubjects] = useState([]);
+  const [weekly, setWeekly] = useState(null);
   const [aiAnalysis, setAiAnalysis] = useState(null);
   const [loading, setLoading] = useState(true);
   const [analyzing, setAnalyzing] = useState(false);
@@ -21,13 +22,15 @@ const Dashboard = ({ user, onLogout }) => {
 
   const fetchDashboardData = async () => {
     try {
-      const [resultsRes, subjectsRes] = await Promise.all([
+      const [resultsRes, subjectsRes, weeklyRes] = await Promise.all([
         api.get('/results'),
-        api.get('/subjects')
+        api.get('/subjects'),
+        api.get('/progress/weekly')
       ]);
       
       setResults(resultsRes.data);
       setSubjects(subjectsRes.data);
+      setWeekly(weeklyRes.data);
     } catch (error) {
       toast.error('Erro ao carregar dados do dashboard');
     } finally {
@@ -51,7 +54,8 @@ const Dashboard = ({ user, onLogout }) => {
   const totalQuestions = results.reduce((sum, r) => sum + r.total_questions, 0);
   const totalCorrect = results.reduce((sum, r) => sum + r.correct_answers, 0);
   const overallAccuracy = totalQuestions > 0 ? (totalCorrect / totalQuestions) * 100 : 0;
-  const weeklyProgress = (totalQuestions / user.weekly_goal) * 100;
+  const weeklyAnswered = weekly ? weekly.answered : 0;
+  const weeklyProgress = (weeklyAnswered / user.weekly_goal) * 100;
 
   if (loading) {
     return (
@@ -82,12 +86,12 @@ const Dashboard = ({ user, onLogout }) => {
                 <Target className="w-5 h-5 text-secondary" />
                 Meta Semanal
               </CardTitle>
-              <CardDescription>{totalQuestions} de {user.weekly_goal} questões</CardDescription>
+              <CardDescription>{weeklyAnswered} de {user.weekly_goal} questões</CardDescription>
             </CardHeader>
             <CardContent>
               <Progress value={Math.min(weeklyProgress, 100)} className="mb-2" />
               <p className="text-sm text-muted-foreground">
-                {weeklyProgress >= 100 ? 'Meta atingida! 🎉' : `Faltam ${user.weekly_goal - totalQuestions} questões`}
+                {weeklyProgress >= 100 ? 'Meta atingida! 🎉' : `Faltam ${user.weekly_goal - weeklyAnswered} questões`}
               </p>
             </CardContent>
           </Card>
@@ -0,0 +1,52 @@
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent / 'backend'))
+
+import os
+from server import (
+    backfill_question_ordinals, create_mongo_client, rebuild_answered_sets, rebuild_leaderboard,
+    rebuild_question_stats, rebuild_ranking_windows, rebuild_study_days,
+)
+
+# (collection, what it is derived from, rebuild); answered_sets needs the question ordinals first
+REBUILDS = [
+    ("answered_sets", "answers", rebuild_answered_sets),
+    ("leaderboard", "results", rebuild_leaderboard),
+    ("ranking_buckets", "answers", rebuild_ranking_windows),
+    ("question_stats", "answers", rebuild_question_stats),
+    ("study_days", "answers", rebuild_study_days),
+]
+
+async def main(args) -> int:
+    client = create_mongo_client()
+    db = client[os.environ['DB_NAME']]
+
+    print("Numerando questões sem ordinal...")
+    await backfill_question_ordinals(db)
+
+    for collection_name, source, rebuild in REBUILDS:
+        if not args.force and await db[collection_name].estimated_document_count() > 0:
+            print(f"- {collection_name}: já populada (use --force para recalcular)")
+            continue
+        if await db[source].estimated_document_count() == 0:
+            print(f"- {collection_name}: nada a recalcular ({source} vazia)")
+            continue
+        print(f"- {collection_name}: recalculando a partir de {source}...")
+        await rebuild(db)
+
+    client.close()
+    print("✅ Coleções derivadas prontas")
+    return 0
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Popula as coleções derivadas (rankings, progresso, estatísticas) a partir das respostas. "
+                    "Rode uma vez, antes de subir os workers: com tráfego, um recálculo sobrescreve incrementos ao vivo"
+    )
+    parser.add_argument("--force", action="store_true", help="recalcula também as coleções já populadas")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
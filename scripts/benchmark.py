@@ -0,0 +1,227 @@
+import argparse
+import asyncio
+import json
+import sys
+import time
+import uuid
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent / 'backend'))
+
+import httpx
+
+DEFAULT_BASELINE = Path(__file__).parent / 'benchmark_baseline.json'
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.elapsed = {}
+
+    async def call(self, client: httpx.AsyncClient, label: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            response, ok = None, False
+        self.samples.setdefault(label, []).append(time.perf_counter() - started)
+        if not ok:
+            self.errors[label] = self.errors.get(label, 0) + 1
+        return response
+
+    def report(self, scenario: str) -> dict:
+        rows = {}
+        for label, samples in self.samples.items():
+            ordered = sorted(samples)
+            rows[f"{scenario} {label}"] = {
+                "count": len(ordered),
+                "errors": self.errors.get(label, 0),
+                "throughput": round(len(ordered) / self.elapsed[scenario], 2) if self.elapsed.get(scenario) else 0,
+                "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+                "p95_ms": round(percentile(ordered, 95) * 1000, 2),
+                "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+            }
+        return rows
+
+def percentile(ordered, pct: float) -> float:
+    if not ordered:
+        return 0.0
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+async def bounded(concurrency: int, jobs):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(job):
+        async with semaphore:
+            return await job
+
+    return await asyncio.gather(*[run(job) for job in jobs])
+
+async def run_scenario(name: str, concurrency: int, jobs, results: dict):
+    recorder = Recorder()
+    started = time.perf_counter()
+    await bounded(concurrency, [job(recorder) for job in jobs])
+    recorder.elapsed[name] = time.perf_counter() - started
+    results.update(recorder.report(name))
+
+async def prepare(client: httpx.AsyncClient, args, promote=None) -> dict:
+    run_id = uuid.uuid4().hex[:8]
+    password = "bench-senha"
+    if promote is None:
+        # Remote server: registration only creates students, so log in with an existing teacher
+        teacher = (await client.post("/api/auth/login", json={
+            "email": args.teacher_email, "password": args.teacher_password
+        })).json()
+    else:
+        teacher = (await client.post("/api/auth/register", json={
+            "name": "Bench Teacher", "email": f"bench-teacher-{run_id}@bench.studyhub", "password": password
+        })).json()
+        await promote(teacher["user"]["id"], "teacher")
+    headers = {"Authorization": f"Bearer {teacher['access_token']}"}
+    subject = (await client.post("/api/subjects", headers=headers, json={
+        "name": f"Bench {run_id}", "icon": "🧪", "color": "#000000"
+    })).json()
+    rows = "\n".join(json.dumps({
+        "subject_id": subject["id"],
+        "difficulty": ["easy", "medium", "hard"][index % 3],
+        "question_text": f"Questão de benchmark {index}",
+        "options": [{"text": str(option), "is_correct": option == index % 4} for option in range(4)],
+        "explanation": "Gerada pelo benchmark."
+    }) for index in range(args.questions))
+    await client.post("/api/questions/import", headers=headers, content=rows.encode())
+    questions = (await client.get("/api/questions", params={"subject_id": subject["id"]})).json()
+
+    emails = [f"bench-{run_id}-{index}@bench.studyhub" for index in range(args.users)]
+    await bounded(args.concurrency, [client.post("/api/auth/register", json={
+        "name": f"Aluno {index}", "email": email, "password": password
+    }) for index, email in enumerate(emails)])
+    return {"subject": subject, "questions": questions, "emails": emails, "password": password}
+
+async def run_benchmark(client: httpx.AsyncClient, args, promote=None) -> dict:
+    data = await prepare(client, args, promote)
+    results = {}
+    tokens = {}
+
+    def login(email):
+        async def job(recorder):
+            response = await recorder.call(client, "POST /api/auth/login", "POST", "/api/auth/login",
+                                           json={"email": email, "password": data["password"]})
+            if response is not None and response.status_code == 200:
+                tokens[email] = response.json()["access_token"]
+        return job
+
+    await run_scenario("login_burst", args.concurrency, [login(email) for email in data["emails"]], results)
+
+    def quiz(email, offset):
+        async def job(recorder):
+            headers = {"Authorization": f"Bearer {tokens.get(email, '')}"}
+            for step in range(args.answers_per_user):
+                question = data["questions"][(offset + step) % len(data["questions"])]
+                await recorder.call(client, "POST /api/answers", "POST", "/api/answers", headers=headers, json={
+                    "question_id": question["id"], "selected_option": (offset + step) % 4, "time_spent": 30
+                })
+        return job
+
+    await run_scenario("quiz_session", args.concurrency,
+                       [quiz(email, index) for index, email in enumerate(data["emails"])], results)
+
+    def poll_ranking(email):
+        async def job(recorder):
+            headers = {"Authorization": f"Bearer {tokens.get(email, '')}"}
+            for _ in range(args.polls_per_user):
+                await recorder.call(client, "GET /api/ranking", "GET", "/api/ranking")
+                await recorder.call(client, "GET /api/ranking/me", "GET", "/api/ranking/me", headers=headers)
+        return job
+
+    await run_scenario("ranking_polling", args.concurrency, [poll_ranking(email) for email in data["emails"]], results)
+
+    def list_questions(index):
+        async def job(recorder):
+            params = {"subject_id": data["subject"]["id"], "limit": 100}
+            if index % 2:
+                params["difficulty"] = "easy"
+            await recorder.call(client, "GET /api/questions", "GET", "/api/questions", params=params)
+            await recorder.call(client, "GET /api/subjects", "GET", "/api/subjects")
+        return job
+
+    await run_scenario("question_listing", args.concurrency,
+                       [list_questions(index) for index in range(args.users * args.polls_per_user)], results)
+    return results
+
+def print_report(results: dict):
+    print(f"{'rota':<44} {'reqs':>6} {'erros':>6} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for label, row in results.items():
+        print(f"{label:<44} {row['count']:>6} {row['errors']:>6} {row['throughput']:>9} "
+              f"{row['p50_ms']:>9} {row['p95_ms']:>9} {row['p99_ms']:>9}")
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for label, row in results.items():
+        base = baseline.get(label)
+        if base is None:
+            continue
+        if row["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{label}: p95 {row['p95_ms']} ms (baseline {base['p95_ms']} ms)")
+        if row["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{label}: {row['throughput']} req/s (baseline {base['throughput']} req/s)")
+        if row["errors"] > base["errors"]:
+            regressions.append(f"{label}: {row['errors']} erros (baseline {base['errors']})")
+    return regressions
+
+async def main(args) -> int:
+    if args.url:
+        if not args.teacher_email or not args.teacher_password:
+            print("--url requer --teacher-email e --teacher-password (conta com papel teacher)")
+            return 2
+        async with httpx.AsyncClient(base_url=args.url, timeout=60) as client:
+            results = await run_benchmark(client, args)
+    else:
+        import server
+        # Every simulated user shares one client address; measure the routes, not the per-IP limits
+        server.RATE_LIMIT_ENABLED = False
+
+        async def promote(user_id: str, role: str):
+            await server.db.users.update_one({"id": user_id}, {"$set": {"role": role}})
+            server.user_cache.invalidate(user_id)
+
+        async with server.app.router.lifespan_context(server.app):
+            # A 500 is counted as an error like over HTTP instead of aborting the run
+            transport = httpx.ASGITransport(app=server.app, raise_app_exceptions=False)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+                results = await run_benchmark(client, args, promote)
+
+    print_report(results)
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2, ensure_ascii=False) + "\n")
+        print(f"\nBaseline salvo em {args.baseline}")
+        return 0
+
+    if args.baseline.exists():
+        regressions = compare(results, json.loads(args.baseline.read_text()), args.tolerance)
+        if regressions:
+            print("\n❌ Regressões em relação ao baseline:")
+            for regression in regressions:
+                print(f"- {regression}")
+            return 1
+        print("\n✅ Dentro do baseline")
+    return 0
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark ponta a ponta das rotas da API")
+    parser.add_argument("--url", help="servidor já em execução (com RATE_LIMIT_ENABLED=false); sem isso o app roda em processo, com o MONGO_URL e DB_NAME do backend/.env")
+    parser.add_argument("--teacher-email", help="com --url: professor usado para importar as questões")
+    parser.add_argument("--teacher-password")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--answers-per-user", type=int, default=45)
+    parser.add_argument("--polls-per-user", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="grava esta execução como novo baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="folga relativa antes de acusar regressão")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
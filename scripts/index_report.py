@@ -0,0 +1,42 @@
+import asyncio
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent / 'backend'))
+
+import os
+from server import create_mongo_client, ensure_indexes, index_usage_report
+
+async def main():
+    client = create_mongo_client()
+    db = client[os.environ['DB_NAME']]
+    
+    if "--ensure" in sys.argv:
+        # Also merges duplicates that would block the unique indexes; run it from one place only
+        print("Mesclando duplicados e criando/verificando índices...")
+        await ensure_indexes(db, dedupe=True)
+    
+    report = await index_usage_report(db)
+    
+    print(f"{'coleção':<12} {'índice':<24} {'ops':>10}  desde")
+    unused = []
+    unexpected = []
+    for row in report:
+        since = row["since"] or "-"
+        print(f"{row['collection']:<12} {row['name']:<24} {row['ops']:>10}  {since}")
+        if row["key"] is None:
+            unexpected.append(f"{row['collection']}.{row['name']} (ausente)")
+        elif not row["expected"]:
+            unexpected.append(f"{row['collection']}.{row['name']} (não declarado)")
+        elif row["ops"] == 0 and row["name"] != "_id_":
+            unused.append(f"{row['collection']}.{row['name']}")
+    
+    if unused:
+        print(f"\n⚠️  Índices sem uso: {', '.join(unused)}")
+    if unexpected:
+        print(f"\n❌ Divergências: {', '.join(unexpected)}")
+    
+    client.close()
+    return 1 if unexpected else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
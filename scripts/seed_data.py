@@ -1,9 +1,14 @@
+import argparse
 import asyncio
 import sys
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 sys.path.append(str(Path(__file__).parent.parent / 'backend'))
 
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+import numpy as np
 import os
 from dotenv import load_dotenv
 
@@ -13,57 +18,68 @@ mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
+SUBJECTS = [
+    {
+        "id": "math",
+        "name": "Matemática",
+        "icon": "📐",
+        "color": "#3B82F6",
+        "total_questions": 0
+    },
+    {
+        "id": "physics",
+        "name": "Física",
+        "icon": "⚛️",
+        "color": "#8B5CF6",
+        "total_questions": 0
+    },
+    {
+        "id": "chemistry",
+        "name": "Química",
+        "icon": "🧪",
+        "color": "#10B981",
+        "total_questions": 0
+    },
+    {
+        "id": "biology",
+        "name": "Biologia",
+        "icon": "🧬",
+        "color": "#F59E0B",
+        "total_questions": 0
+    },
+    {
+        "id": "portuguese",
+        "name": "Português",
+        "icon": "📚",
+        "color": "#EF4444",
+        "total_questions": 0
+    },
+    {
+        "id": "history",
+        "name": "História",
+        "icon": "🏛️",
+        "color": "#6366F1",
+        "total_questions": 0
+    }
+]
+
+async def recount_subject_questions():
+    counts = await db.questions.aggregate([
+        {"$group": {"_id": "$subject_id", "count": {"$sum": 1}}}
+    ]).to_list(None)
+    by_subject = {row["_id"]: row["count"] for row in counts}
+    await db.subjects.bulk_write([
+        ReplaceOne({"id": subject["id"]}, {**subject, "total_questions": by_subject.get(subject["id"], 0)}, upsert=True)
+        for subject in SUBJECTS
+    ])
+
 async def seed_data():
     print("Limpando dados existentes...")
     await db.subjects.delete_many({})
     await db.questions.delete_many({})
     
     print("Inserindo matérias...")
-    subjects = [
-        {
-            "id": "math",
-            "name": "Matemática",
-            "icon": "📐",
-            "color": "#3B82F6",
-            "total_questions": 0
-        },
-        {
-            "id": "physics",
-            "name": "Física",
-            "icon": "⚛️",
-            "color": "#8B5CF6",
-            "total_questions": 0
-        },
-        {
-            "id": "chemistry",
-            "name": "Química",
-            "icon": "🧪",
-            "color": "#10B981",
-            "total_questions": 0
-        },
-        {
-            "id": "biology",
-            "name": "Biologia",
-            "icon": "🧬",
-            "color": "#F59E0B",
-            "total_questions": 0
-        },
-        {
-            "id": "portuguese",
-            "name": "Português",
-            "icon": "📚",
-            "color": "#EF4444",
-            "total_questions": 0
-        },
-        {
-            "id": "history",
-            "name": "História",
-            "icon": "🏛️",
-            "color": "#6366F1",
-            "total_questions": 0
-        }
-    ]
-    
+    subjects = [dict(subject) for subject in SUBJECTS]
     await db.subjects.insert_many(subjects)
     
     print("Inserindo questões de exemplo...")
@@ -192,14 +208,251 @@ async def seed_data():
     
     await db.questions.insert_many(questions)
     
-    # Update subject total_questions
-    for subject in subjects:
-        count = await db.questions.count_documents({"subject_id": subject["id"]})
-        await db.subjects.update_one({"id": subject["id"]}, {"$set": {"total_questions": count}})
+    await recount_subject_questions()
     
     print("✅ Dados iniciais inseridos com sucesso!")
     print(f"- {len(subjects)} matérias criadas")
     print(f"- {len(questions)} questões criadas")
 
+# ========== LOAD GENERATOR ==========
+
+FIRST_NAMES = ["Ana", "Bruno", "Carla", "Diego", "Eduarda", "Felipe", "Gabriela", "Henrique", "Isabela", "João",
+               "Larissa", "Lucas", "Mariana", "Matheus", "Natália", "Pedro", "Rafaela", "Rodrigo", "Sofia", "Vinícius"]
+LAST_NAMES = ["Silva", "Santos", "Oliveira", "Souza", "Rodrigues", "Ferreira", "Alves", "Pereira", "Lima", "Gomes",
+              "Costa", "Ribeiro", "Martins", "Carvalho", "Almeida", "Lopes", "Soares", "Fernandes", "Vieira", "Barbosa"]
+DIFFICULTIES = ["easy", "medium", "hard"]
+ENTITY_CODES = {"users": 1, "questions": 2, "answers": 3}
+HISTORY_DAYS = 90
+OPTIONS_PER_QUESTION = 4
+
+class LoadProfile:
+    # Per-entity attributes derived only from the seed, so every producer (and every resumed run) agrees
+    def __init__(self, users: int, questions: int, seed: int):
+        rng = np.random.default_rng(seed)
+        self.seed = seed
+        self.users = users
+        self.questions = questions
+        self.user_skill = rng.beta(5, 3, size=users)
+        # Heavy-tailed activity: a few students answer most of the questions
+        self.user_cdf = np.cumsum(self._zipf_weights(users, 1.0, rng))
+        self.question_subject = rng.choice(len(SUBJECTS), size=questions, p=[0.25, 0.15, 0.15, 0.15, 0.2, 0.1])
+        self.question_difficulty = rng.choice(len(DIFFICULTIES), size=questions, p=[0.4, 0.4, 0.2])
+        self.question_correct = rng.integers(0, OPTIONS_PER_QUESTION, size=questions)
+        self.question_cdf = np.cumsum(self._zipf_weights(questions, 0.6, rng))
+        # Day-aligned so a resumed run on the same day produces identical timestamps
+        self.now = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    
+    @staticmethod
+    def _zipf_weights(n: int, exponent: float, rng) -> np.ndarray:
+        weights = 1.0 / np.arange(1, n + 1) ** exponent
+        rng.shuffle(weights)
+        return weights / weights.sum()
+    
+    def rng(self, entity: str, chunk: int):
+        return np.random.default_rng([self.seed, ENTITY_CODES[entity], chunk])
+
+def user_id(index: int) -> str:
+    return f"load-user-{index:08d}"
+
+def question_id(index: int) -> str:
+    return f"load-q-{index:08d}"
+
+def generate_users(profile: LoadProfile, chunk: int, start: int, stop: int, password_hash: str):
+    rng = profile.rng("users", chunk)
+    first = rng.integers(0, len(FIRST_NAMES), size=stop - start)
+    last = rng.integers(0, len(LAST_NAMES), size=stop - start)
+    days = rng.integers(HISTORY_DAYS, 3 * HISTORY_DAYS, size=stop - start)
+    return [
+        {
+            "id": user_id(index),
+            "name": f"{FIRST_NAMES[first[i]]} {LAST_NAMES[last[i]]}",
+            "email": f"aluno{index}@carga.studyhub",
+            "password_hash": password_hash,
+            "role": "student",
+            "avatar": None,
+            "weekly_goal": 50,
+            "created_at": (profile.now - timedelta(days=int(days[i]))).isoformat()
+        }
+        for i, index in enumerate(range(start, stop))
+    ]
+
+def generate_questions(profile: LoadProfile, chunk: int, start: int, stop: int):
+    rng = profile.rng("questions", chunk)
+    numbers = rng.integers(1, 1000, size=(stop - start, OPTIONS_PER_QUESTION))
+    docs = []
+    for i, index in enumerate(range(start, stop)):
+        subject = SUBJECTS[profile.question_subject[index]]
+        correct = profile.question_correct[index]
+        docs.append({
+            "id": question_id(index),
+            "subject_id": subject["id"],
+            "difficulty": DIFFICULTIES[profile.question_difficulty[index]],
+            "question_text": f"Questão {index} de {subject['name']}: qual alternativa está correta?",
+            "options": [
+                {"text": f"Alternativa {numbers[i][option]}", "is_correct": bool(option == correct)}
+                for option in range(OPTIONS_PER_QUESTION)
+            ],
+            "explanation": f"A alternativa {correct + 1} é a correta.",
+            "created_by": "system",
+            "created_at": profile.now.isoformat()
+        })
+    return docs
+
+def generate_answers(profile: LoadProfile, chunk: int, start: int, stop: int):
+    rng = profile.rng("answers", chunk)
+    size = stop - start
+    users = np.minimum(np.searchsorted(profile.user_cdf, rng.random(size)), profile.users - 1)
+    questions = np.minimum(np.searchsorted(profile.question_cdf, rng.random(size)), profile.questions - 1)
+    difficulty = profile.question_difficulty[questions]
+    p_correct = np.clip(profile.user_skill[users] + 0.1 - 0.15 * difficulty, 0.05, 0.95)
+    is_correct = rng.random(size) < p_correct
+    correct_option = profile.question_correct[questions]
+    wrong_option = (correct_option + rng.integers(1, OPTIONS_PER_QUESTION, size=size)) % OPTIONS_PER_QUESTION
+    selected = np.where(is_correct, correct_option, wrong_option)
+    time_spent = np.clip(rng.lognormal(np.log(60), 0.6, size=size), 5, 600).astype(int)
+    seconds_ago = rng.random(size) * HISTORY_DAYS * 86400
+    return [
+        {
+            "id": f"load-a-{index:010d}",
+            "user_id": user_id(int(users[i])),
+            "question_id": question_id(int(questions[i])),
+            "selected_option": int(selected[i]),
+            "is_correct": bool(is_correct[i]),
+            "answered_at": (profile.now - timedelta(seconds=float(seconds_ago[i]))).isoformat(),
+            "time_spent": int(time_spent[i])
+        }
+        for i, index in enumerate(range(start, stop))
+    ]
+
+async def write_chunk(collection_name: str, docs):
+    if collection_name == "answers":
+        # Deterministic ids + the answers.id_unique index (ensured above) make a re-run of a
+        # half-written chunk harmless
+        try:
+            await db.answers.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+    else:
+        # $set rather than replace, so a re-run keeps server-assigned fields such as question ordinals
+        await db[collection_name].bulk_write(
+            [UpdateOne({"id": doc["id"]}, {"$set": doc}, upsert=True) for doc in docs], ordered=False
+        )
+
+async def produce(entity: str, total: int, batch_size: int, workers: int, generate, resume: bool):
+    done = set()
+    if resume:
+        markers = await db.seed_progress.find({"entity": entity}, {"_id": 0, "chunk": 1}).to_list(None)
+        done = {marker["chunk"] for marker in markers}
+    else:
+        await db.seed_progress.delete_many({"entity": entity})
+    
+    queue = asyncio.Queue()
+    for chunk in range((total + batch_size - 1) // batch_size):
+        if chunk not in done:
+            queue.put_nowait(chunk)
+    pending = queue.qsize()
+    print(f"- {entity}: {total} documentos, {pending} lotes a gerar ({len(done)} já concluídos)")
+    
+    loop = asyncio.get_running_loop()
+    progress = {"written": 0}
+    
+    async def worker():
+        while not queue.empty():
+            chunk = queue.get_nowait()
+            start = chunk * batch_size
+            stop = min(start + batch_size, total)
+            # Generation is numpy-bound; run it off the loop so writes keep flowing
+            docs = await loop.run_in_executor(None, generate, chunk, start, stop)
+            await write_chunk(entity, docs)
+            await db.seed_progress.insert_one({"entity": entity, "chunk": chunk})
+            progress["written"] += 1
+            if progress["written"] % 100 == 0 or progress["written"] == pending:
+                print(f"  {entity}: {progress['written']}/{pending} lotes")
+    
+    await asyncio.gather(*[worker() for _ in range(workers)])
+
+async def rebuild_results():
+    # Derived server-side from answers, so it is always consistent after a resumed run
+    await db.results.delete_many({"user_id": {"$regex": "^load-user-"}})
+    await db.answers.aggregate([
+        {"$match": {"id": {"$regex": "^load-a-"}}},
+        {"$lookup": {"from": "questions", "localField": "question_id", "foreignField": "id", "as": "question"}},
+        {"$unwind": "$question"},
+        {"$group": {
+            "_id": {"user_id": "$user_id", "subject_id": "$question.subject_id"},
+            "total_questions": {"$sum": 1},
+            "correct_answers": {"$sum": {"$cond": ["$is_correct", 1, 0]}}
+        }},
+        {"$project": {
+            "_id": 0,
+            "id": {"$concat": ["load-r-", "$_id.user_id", "-", "$_id.subject_id"]},
+            "user_id": "$_id.user_id",
+            "subject_id": "$_id.subject_id",
+            "total_questions": 1,
+            "correct_answers": 1,
+            "accuracy": {"$multiply": [{"$divide": ["$correct_answers", "$total_questions"]}, 100]},
+            "last_updated": {"$literal": datetime.now(timezone.utc).isoformat()}
+        }},
+        {"$merge": {"into": "results", "on": ["user_id", "subject_id"], "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ], allowDiskUse=True).to_list(None)
+
+async def generate_load_data(args):
+    from server import (
+        backfill_question_ordinals, ensure_indexes, pwd_context, rebuild_answered_sets, rebuild_leaderboard,
+        rebuild_question_stats, rebuild_ranking_windows, rebuild_study_days,
+    )
+    
+    print("Garantindo índices...")
+    await ensure_indexes(db)
+    await recount_subject_questions()
+    
+    profile = LoadProfile(args.users, args.questions, args.seed)
+    password_hash = pwd_context.hash(args.password)
+    started = datetime.now()
+    
+    print("Gerando dados de carga...")
+    await produce("users", args.users, args.batch_size, args.workers,
+                  lambda chunk, start, stop: generate_users(profile, chunk, start, stop, password_hash), args.resume)
+    await produce("questions", args.questions, args.batch_size, args.workers,
+                  lambda chunk, start, stop: generate_questions(profile, chunk, start, stop), args.resume)
+    await produce("answers", args.answers, args.batch_size, args.workers,
+                  lambda chunk, start, stop: generate_answers(profile, chunk, start, stop), args.resume)
+    
+    print("Recalculando resultados, rankings, progresso, estatísticas e totais por matéria...")
+    await rebuild_results()
+    await rebuild_leaderboard(db)
+    await rebuild_ranking_windows(db)
+    await rebuild_study_days(db)
+    await rebuild_question_stats(db)
+    await recount_subject_questions()
+    # /questions/next skips answered questions through answered_sets, which need question ordinals
+    await backfill_question_ordinals(db)
+    await rebuild_answered_sets(db)
+    
+    print(f"✅ Dados de carga gerados em {datetime.now() - started}")
+    print(f"- {args.users} usuários (senha: {args.password})")
+    print(f"- {args.questions} questões")
+    print(f"- {args.answers} respostas")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Popula o banco do StudyHub")
+    parser.add_argument("--users", type=int, default=0, help="usuários sintéticos a gerar")
+    parser.add_argument("--questions", type=int, default=0, help="questões sintéticas a gerar")
+    parser.add_argument("--answers", type=int, default=0, help="respostas sintéticas a gerar")
+    parser.add_argument("--batch-size", type=int, default=5000, help="documentos por lote (bulk_write)")
+    parser.add_argument("--workers", type=int, default=4, help="produtores em paralelo")
+    parser.add_argument("--seed", type=int, default=42, help="semente aleatória (mesma semente = mesmos dados)")
+    parser.add_argument("--password", default="senha123", help="senha de todos os usuários sintéticos")
+    parser.add_argument("--resume", action="store_true", help="continua uma geração interrompida")
+    args = parser.parse_args()
+    if args.answers and (not args.users or not args.questions):
+        parser.error("--answers requer --users e --questions")
+    return args
+
 if __name__ == "__main__":
-    asyncio.run(seed_data())
+    args = parse_args()
+    if args.users or args.questions or args.answers:
+        asyncio.run(generate_load_data(args))
+    else:
+        asyncio.run(seed_data())
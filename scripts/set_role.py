@@ -0,0 +1,32 @@
+import asyncio
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent / 'backend'))
+
+import os
+from server import create_mongo_client
+
+ROLES = ("student", "teacher", "admin")
+
+async def main(email: str, role: str) -> int:
+    if role not in ROLES:
+        print(f"Papel inválido: {role} (use {', '.join(ROLES)})")
+        return 2
+    
+    client = create_mongo_client()
+    db = client[os.environ['DB_NAME']]
+    result = await db.users.update_one({"email": email}, {"$set": {"role": role}})
+    client.close()
+    
+    if result.matched_count == 0:
+        print(f"❌ Usuário não encontrado: {email}")
+        return 1
+    # Workers cache users for USER_CACHE_TTL_SECONDS, so the new role applies within that window
+    print(f"✅ {email} agora é {role}")
+    return 0
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Uso: python scripts/set_role.py <email> <student|teacher|admin>")
+        sys.exit(2)
+    sys.exit(asyncio.run(main(sys.argv[1], sys.argv[2])))
@@ -0,0 +1,36 @@
+import os
+import sys
+import types
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+# server reads its configuration at import time; real values from backend/.env still win
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "studyhub_test")
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret-key-with-at-least-32-bytes")
+os.environ.setdefault("EMERGENT_LLM_KEY", "test")
+os.environ["AI_FAKE_LLM"] = "true"
+os.environ["AI_FAKE_LLM_DELAY_MS"] = "20"
+
+try:
+    import emergentintegrations.llm.chat  # noqa: F401
+except ImportError:
+    # The LLM client is a private package; with AI_FAKE_LLM the tests never call it, so the
+    # server only needs the names it imports
+    class UserMessage:
+        def __init__(self, text: str):
+            self.text = text
+
+    class LlmChat:
+        def __init__(self, *args, **kwargs):
+            raise RuntimeError("emergentintegrations is not installed; tests run with AI_FAKE_LLM")
+
+    package = types.ModuleType("emergentintegrations")
+    llm = types.ModuleType("emergentintegrations.llm")
+    chat = types.ModuleType("emergentintegrations.llm.chat")
+    chat.LlmChat, chat.UserMessage = LlmChat, UserMessage
+    package.llm, llm.chat = llm, chat
+    sys.modules.update({
+        "emergentintegrations": package, "emergentintegrations.llm": llm, "emergentintegrations.llm.chat": chat,
+    })
@@ -0,0 +1,89 @@
+import pytest
+
+import server
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(server.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_take_allows_burst_then_waits(clock):
+    buckets = server.TokenBuckets(2, 10, max_keys=10)
+    assert buckets.take("a") == 0
+    assert buckets.take("a") == 0
+    assert buckets.take("a") == pytest.approx(5.0)
+
+
+def test_take_refills_over_time(clock):
+    buckets = server.TokenBuckets(2, 10, max_keys=10)
+    buckets.take("a")
+    buckets.take("a")
+    clock[0] += 5
+    assert buckets.take("a") == 0
+    assert buckets.take("a") == pytest.approx(5.0)
+
+
+def test_take_never_refills_above_capacity(clock):
+    buckets = server.TokenBuckets(2, 10, max_keys=10)
+    buckets.take("a")
+    clock[0] += 3600
+    assert buckets.take("a") == 0
+    assert buckets.take("a") == 0
+    assert buckets.take("a") > 0
+
+
+def test_take_keys_are_independent(clock):
+    buckets = server.TokenBuckets(1, 10, max_keys=10)
+    assert buckets.take("a") == 0
+    assert buckets.take("b") == 0
+    assert buckets.take("a") > 0
+
+
+def test_take_evicts_least_recently_used_key(clock):
+    buckets = server.TokenBuckets(1, 10, max_keys=2)
+    buckets.take("a")
+    buckets.take("b")
+    buckets.take("a")
+    buckets.take("c")
+    assert len(buckets) == 2
+    assert buckets.evicted == 1
+    # "b" was evicted, so it starts again with a full bucket
+    assert buckets.take("b") == 0
+
+
+def test_policy_without_client_key_uses_shared_bucket(clock):
+    policy = server.AdmissionPolicy("test", "1/60", 10, shared_rate="2/60")
+    policy.enter(None)
+    policy.enter(None)
+    with pytest.raises(server.HTTPException) as error:
+        policy.enter(None)
+    assert error.value.status_code == 429
+    assert policy.shed["rate_limited"] == 1
+    # Keyed clients still get their own bucket
+    policy.enter("1.2.3.4")
+
+
+def test_policy_without_client_key_or_shared_bucket_only_caps_in_flight(clock):
+    policy = server.AdmissionPolicy("test", "1/60", 2)
+    policy.enter(None)
+    policy.enter(None)
+    with pytest.raises(server.HTTPException) as error:
+        policy.enter(None)
+    assert error.value.status_code == 503
+
+
+def test_client_ip_ignores_forwarded_for_from_untrusted_peer(monkeypatch):
+    monkeypatch.setattr(server, "TRUSTED_PROXIES", [server.ipaddress.ip_network("10.0.0.0/8")])
+    request = server.Request({"type": "http", "client": ("203.0.113.9", 1234),
+                              "headers": [(b"x-forwarded-for", b"198.51.100.1")]})
+    assert server.client_ip(request) == "203.0.113.9"
+
+
+def test_client_ip_walks_forwarded_for_past_trusted_proxies(monkeypatch):
+    monkeypatch.setattr(server, "TRUSTED_PROXIES", [server.ipaddress.ip_network("10.0.0.0/8")])
+    request = server.Request({"type": "http", "client": ("10.0.0.2", 1234),
+                              "headers": [(b"x-forwarded-for", b"6.6.6.6, 198.51.100.1, 10.0.0.3")]})
+    assert server.client_ip(request) == "198.51.100.1"
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+import server
+
+
+def test_split_analysis_at_study_plan_item():
+    recommendations, study_plan = server.split_analysis("1. Revise frações.\n2. Estude 30 minutos por dia.")
+    assert recommendations == "1. Revise frações."
+    assert study_plan == "2. Estude 30 minutos por dia."
+
+
+def test_split_analysis_marker_with_markdown():
+    recommendations, study_plan = server.split_analysis("**1.** Revise.\n**2)** Plano semanal.")
+    assert recommendations == "**1.** Revise."
+    assert study_plan == "**2)** Plano semanal."
+
+
+def test_split_analysis_short_text_without_marker():
+    assert server.split_analysis("  Revise frações.  ") == ("Revise frações.", "Continue praticando regularmente!")
+
+
+def test_split_analysis_long_text_cuts_at_sentence_boundary():
+    first = "Revise os conteúdos de frações e porcentagem com calma. " * 4
+    second = "Depois resolva listas de exercícios todos os dias da semana. " * 4
+    recommendations, study_plan = server.split_analysis(first + second)
+    assert len(recommendations) <= 300
+    assert recommendations.endswith(".")
+    assert (recommendations + " " + study_plan).split() == (first + second).split()
+
+
+def test_split_analysis_does_not_split_on_numbers_mid_line():
+    text = "Você acertou 2. das questões? " + "Continue estudando. " * 20
+    recommendations, _ = server.split_analysis(text)
+    assert recommendations.startswith("Você acertou 2.")
+
+
+@pytest.fixture
+def analysis_db(monkeypatch):
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    database = mongomock_motor.AsyncMongoMockClient()["studyhub_test"]
+    monkeypatch.setattr(server, "db", database)
+    server.ai_cache._data.clear()
+    server.ai_inflight.clear()
+    return database
+
+
+def test_stream_and_sync_analysis_share_one_llm_call(analysis_db, monkeypatch):
+    chats = []
+    original = server.new_analysis_chat
+
+    def counting_chat(user_id):
+        chats.append(user_id)
+        return original(user_id)
+    monkeypatch.setattr(server, "new_analysis_chat", counting_chat)
+
+    async def stream():
+        return [event.split("\n")[0] async for event in server.stream_ai_analysis("u1")]
+
+    async def scenario():
+        await analysis_db.subjects.insert_one({"id": "s1", "name": "Matemática"})
+        await analysis_db.results.insert_one({
+            "user_id": "u1", "subject_id": "s1", "total_questions": 10, "correct_answers": 4, "accuracy": 40.0
+        })
+        first, second = stream(), stream()
+        return await asyncio.gather(first, second, server.get_ai_analysis("u1"))
+
+    first, second, analysis = asyncio.run(scenario())
+    assert len(chats) == 1
+    assert first[0] == "event: weak_subjects" and first[-1] == "event: done"
+    assert "event: token" in first
+    # The second stream joined the in-flight call, so it only gets the result
+    assert second == ["event: weak_subjects", "event: done"]
+    assert analysis.study_plan.startswith("2. Na segunda")
+    assert server.ai_inflight == {}
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def job_db(monkeypatch):
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    database = mongomock_motor.AsyncMongoMockClient()["studyhub_test"]
+    monkeypatch.setattr(server, "db", database)
+    server.ai_cache._data.clear()
+    server.ai_inflight.clear()
+    return database
+
+
+async def seed_results(database, user_id):
+    await database.subjects.insert_one({"id": "s1", "name": "Matemática"})
+    await database.results.insert_one({
+        "user_id": user_id, "subject_id": "s1", "total_questions": 10, "correct_answers": 4, "accuracy": 40.0
+    })
+
+
+def test_job_queue_runs_analysis_with_fake_llm(job_db):
+    async def scenario():
+        await seed_results(job_db, "u1")
+        queue = server.AIJobQueue(1, 10)
+        queue.start()
+        try:
+            job = await queue.submit("u1")
+            # A second submit while the first is active returns the same job
+            assert (await queue.submit("u1"))["id"] == job["id"]
+            await queue.wait(job["id"], 5)
+        finally:
+            await queue.close()
+        return await job_db.ai_jobs.find_one({"id": job["id"]}, {"_id": 0})
+
+    stored = asyncio.run(scenario())
+    assert stored["status"] == "done"
+    assert "active" not in stored and "lease_until" not in stored
+    assert stored["result"]["weak_subjects"] == [{"name": "Matemática", "accuracy": 40.0, "total_questions": 10}]
+    assert stored["result"]["recommendations"].startswith("1. Revise primeiro")
+    assert stored["result"]["study_plan"].startswith("2. Na segunda")
+
+
+def test_job_queue_marks_failed_jobs(job_db, monkeypatch):
+    async def broken(user_id):
+        raise RuntimeError("boom")
+    monkeypatch.setattr(server, "get_ai_analysis", broken)
+
+    async def scenario():
+        queue = server.AIJobQueue(1, 10)
+        queue.start()
+        try:
+            job = await queue.submit("u1")
+            await queue.wait(job["id"], 5)
+            # The failed job no longer blocks a new one
+            retry = await queue.submit("u1")
+        finally:
+            await queue.close()
+        return await job_db.ai_jobs.find_one({"id": job["id"]}, {"_id": 0}), retry
+
+    stored, retry = asyncio.run(scenario())
+    assert stored["status"] == "failed"
+    assert stored["error"] == "analysis failed"
+    assert retry["id"] != stored["id"]
+
+
+def test_job_queue_concurrent_submits_never_overfill_the_queue(job_db):
+    async def submit(queue, user_id):
+        try:
+            return (await queue.submit(user_id))["id"]
+        except server.HTTPException as e:
+            return e.status_code
+
+    async def scenario():
+        queue = server.AIJobQueue(1, 1)
+        # No workers: the single slot stays taken
+        queue._queue = server.asyncio.Queue(maxsize=1)
+        outcomes = await asyncio.gather(*[submit(queue, f"u{index}") for index in range(4)])
+        active = await job_db.ai_jobs.count_documents({"active": True})
+        return outcomes, active, queue
+
+    outcomes, active, queue = asyncio.run(scenario())
+    assert sorted(outcome == 503 for outcome in outcomes) == [False, True, True, True]
+    assert active == 1
+    assert len(queue._events) == 1
+    assert queue._reserved == 0
@@ -0,0 +1,40 @@
+import server
+
+BITS = server.ANSWERED_WORD_BITS
+
+
+def test_answered_bits_groups_ordinals_by_word():
+    words = server.answered_bits([0, 3, BITS, BITS + 1])
+    assert words == {"0": 0b1001, "1": 0b11}
+
+
+def test_answered_bits_repeated_ordinals():
+    assert server.answered_bits([5, 5]) == {"0": 1 << 5}
+
+
+def test_answered_bits_empty():
+    assert server.answered_bits([]) == {}
+
+
+def test_answered_bits_fit_a_signed_word():
+    # Masks are stored as Int64, so the top bit of a word must still fit
+    words = server.answered_bits([BITS - 1])
+    assert words["0"] == 1 << (BITS - 1)
+    assert words["0"] < 2 ** 63
+
+
+def test_is_answered_round_trip():
+    ordinals = {0, 7, BITS - 1, BITS, 5 * BITS + 3}
+    words = server.answered_bits(ordinals)
+    for ordinal in range(6 * BITS):
+        assert server.is_answered(words, ordinal) == (ordinal in ordinals)
+
+
+def test_is_answered_missing_word():
+    assert not server.is_answered({}, 42)
+
+
+def test_answered_set_update_ors_int64_masks():
+    update = server.answered_set_update({"0": 0b101, "3": 1})
+    assert update == {"$bit": {"w.0": {"or": server.Int64(0b101)}, "w.3": {"or": server.Int64(1)}}}
+    assert all(isinstance(op["or"], server.Int64) for op in update["$bit"].values())
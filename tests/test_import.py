@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+import server
+
+HEADER = ["subject_id", "difficulty", "question_text", "explanation", "correct_option", "option_1", "option_2",
+          "option_3"]
+
+
+async def byte_chunks(*parts):
+    for part in parts:
+        yield part
+
+
+def collect_csv(*parts):
+    async def collect():
+        return [row async for row in server.iter_csv_rows(byte_chunks(*parts))]
+    return asyncio.run(collect())
+
+
+def test_csv_row_to_question_marks_correct_option():
+    question = server.csv_row_to_question(HEADER, ["s1", "easy", "2+2?", "Soma", "2", "três", "quatro", "cinco"])
+    assert question == {
+        "subject_id": "s1",
+        "difficulty": "easy",
+        "question_text": "2+2?",
+        "explanation": "Soma",
+        "options": [
+            {"text": "três", "is_correct": False},
+            {"text": "quatro", "is_correct": True},
+            {"text": "cinco", "is_correct": False},
+        ],
+    }
+
+
+def test_csv_row_to_question_orders_options_numerically_and_skips_blanks():
+    header = ["subject_id", "correct_option", "option_10", "option_2", "option_1"]
+    question = server.csv_row_to_question(header, ["s1", "1", "dez", "", "um"])
+    assert [option["text"] for option in question["options"]] == ["um", "dez"]
+
+
+def test_csv_row_to_question_rejects_non_numeric_correct_option():
+    with pytest.raises(ValueError):
+        server.csv_row_to_question(HEADER, ["s1", "easy", "q", "", "b", "x", "y", ""])
+
+
+def test_iter_csv_rows_numbers_data_rows_after_header():
+    rows = collect_csv(
+        b"\xef\xbb\xbf" + ",".join(HEADER).encode() + b"\n",
+        b"s1,easy,Q1,,1,a,b,\n\ns1,hard,Q2,,2,a,b,\n",
+    )
+    assert [(row, question["question_text"]) for row, question in rows] == [(1, "Q1"), (2, "Q2")]
+
+
+def test_iter_csv_rows_joins_lines_split_across_chunks():
+    rows = collect_csv(",".join(HEADER).encode() + b"\ns1,easy,Qu", "estão,,1,a,b,\n".encode())
+    assert rows[0][1]["question_text"] == "Questão"
+
+
+def test_iter_csv_rows_quoted_field_spanning_lines():
+    rows = collect_csv(",".join(HEADER).encode() + b'\ns1,easy,"linha 1\nlinha 2, com virgula",,1,a,b,\n')
+    assert rows[0][1]["question_text"] == "linha 1\nlinha 2, com virgula"
+
+
+def test_iter_csv_rows_yields_row_errors():
+    rows = collect_csv(",".join(HEADER).encode() + b"\ns1,easy,Q1,,x,a,b,\ns1,easy,Q2,,1,a,b,\n")
+    assert rows[0][0] == 1 and isinstance(rows[0][1], ValueError)
+    assert rows[1][0] == 2 and rows[1][1]["question_text"] == "Q2"
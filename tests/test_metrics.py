@@ -0,0 +1,17 @@
+import server
+
+
+def test_format_labels_pairs_names_and_values():
+    assert server.format_labels(("method", "route"), ("GET", "/api/x")) == '{method="GET",route="/api/x"}'
+
+
+def test_format_labels_appends_extra_label():
+    assert server.format_labels(("route",), ("/api/x",), ("le", "0.5")) == '{route="/api/x",le="0.5"}'
+
+
+def test_format_labels_empty():
+    assert server.format_labels((), ()) == ""
+
+
+def test_format_labels_escapes_values():
+    assert server.format_labels(("q",), ('a"b\\c\nd',)) == '{q="a\\"b\\\\c\\nd"}'
@@ -0,0 +1,44 @@
+import server
+
+
+def test_compute_streaks_no_days():
+    assert server.compute_streaks([], "2026-03-10") == {"current": 0, "longest": 0, "last_study_day": None}
+
+
+def test_compute_streaks_current_run_including_today():
+    days = ["2026-03-10", "2026-03-09", "2026-03-08", "2026-03-05", "2026-03-04"]
+    assert server.compute_streaks(days, "2026-03-10") == {
+        "current": 3, "longest": 3, "last_study_day": "2026-03-10"
+    }
+
+
+def test_compute_streaks_alive_until_a_whole_day_is_skipped():
+    days = ["2026-03-09", "2026-03-08"]
+    assert server.compute_streaks(days, "2026-03-10")["current"] == 2
+    assert server.compute_streaks(days, "2026-03-11")["current"] == 0
+
+
+def test_compute_streaks_longest_is_an_older_run():
+    days = ["2026-03-10", "2026-03-07", "2026-03-06", "2026-03-05", "2026-03-04"]
+    assert server.compute_streaks(days, "2026-03-10") == {
+        "current": 1, "longest": 4, "last_study_day": "2026-03-10"
+    }
+
+
+def test_compute_streaks_across_month_boundary():
+    days = ["2026-03-01", "2026-02-28", "2026-02-27"]
+    assert server.compute_streaks(days, "2026-03-01")["current"] == 3
+
+
+def test_study_day_uses_study_timezone(monkeypatch):
+    monkeypatch.setattr(server, "STUDY_TIMEZONE", server.ZoneInfo("America/Sao_Paulo"))
+    # 01:30 UTC is still the previous evening in Brasília
+    assert server.study_day(server.datetime(2026, 3, 10, 1, 30, tzinfo=server.timezone.utc)) == "2026-03-09"
+    assert server.study_day(server.datetime(2026, 3, 10, 3, 0, tzinfo=server.timezone.utc)) == "2026-03-10"
+
+
+def test_fill_study_days_fills_gaps_with_zeros():
+    days = {"2026-03-09": {"day": "2026-03-09", "answered": 3, "correct": 2, "time_spent": 90}}
+    series = server.fill_study_days(days, server.date(2026, 3, 8), 3)
+    assert [day["day"] for day in series] == ["2026-03-08", "2026-03-09", "2026-03-10"]
+    assert [day["answered"] for day in series] == [0, 3, 0]
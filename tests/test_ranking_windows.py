@@ -0,0 +1,81 @@
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import server
+
+# mongomock cannot run the aggregation ($substrCP, $dateFromString, $dateToString with a timezone, $merge),
+# so this runs against a real server: TEST_MONGO_URL=mongodb://localhost:27017 python -m pytest tests
+TEST_MONGO_URL = os.environ.get("TEST_MONGO_URL")
+pytestmark = pytest.mark.skipif(not TEST_MONGO_URL, reason="set TEST_MONGO_URL to a disposable mongod")
+
+MOMENTS = [
+    # ISO week-year boundaries: 2020 has a week 53, and 2024-12-30 already belongs to 2025-W01
+    datetime(2020, 12, 31, 15, 0, tzinfo=timezone.utc),
+    datetime(2021, 1, 3, 12, 0, tzinfo=timezone.utc),
+    # Monday 02:00 UTC is still Sunday in Brasília, so it stays in 2020-W53 locally
+    datetime(2021, 1, 4, 2, 0, tzinfo=timezone.utc),
+    datetime(2024, 12, 29, 23, 30, tzinfo=timezone.utc),
+    datetime(2024, 12, 30, 12, 0, tzinfo=timezone.utc),
+    # 01:00 UTC on the 1st is the previous month in Brasília
+    datetime(2025, 3, 1, 1, 0, tzinfo=timezone.utc),
+    datetime(2025, 3, 1, 12, 0, tzinfo=timezone.utc),
+]
+
+
+@pytest.fixture
+def retention(monkeypatch):
+    # Long enough for the fixed dates above to be inside the rebuild window
+    windows = {"week": timedelta(days=20 * 365), "month": timedelta(days=21 * 365)}
+    monkeypatch.setattr(server, "RANKING_BUCKET_RETENTION", windows)
+    monkeypatch.setattr(server, "STUDY_TIMEZONE_NAME", "America/Sao_Paulo")
+    monkeypatch.setattr(server, "STUDY_TIMEZONE", server.ZoneInfo("America/Sao_Paulo"))
+    return windows
+
+
+def expected_buckets():
+    buckets = {}
+    for index, moment in enumerate(MOMENTS):
+        for board, expires_at in server.ranking_boards("s1", moment):
+            if expires_at is None:
+                continue
+            bucket = buckets.setdefault(board, {"total_questions": 0, "correct_answers": 0, "expires_at": None})
+            bucket["total_questions"] += 1
+            bucket["correct_answers"] += index % 2
+            bucket["expires_at"] = max(bucket["expires_at"] or expires_at, expires_at)
+    return buckets
+
+
+def test_rebuild_ranking_windows_matches_ranking_boards(retention):
+    async def scenario():
+        client = AsyncIOMotorClient(TEST_MONGO_URL)
+        database = client[f"studyhub_test_{uuid.uuid4().hex[:8]}"]
+        try:
+            await server.ensure_indexes(database)
+            await database.users.insert_one({"id": "u1", "name": "Ana"})
+            await database.questions.insert_one({"id": "q1", "subject_id": "s1"})
+            await database.answers.insert_many([
+                {"id": f"a{index}", "user_id": "u1", "question_id": "q1", "is_correct": bool(index % 2),
+                 "answered_at": moment.isoformat()}
+                for index, moment in enumerate(MOMENTS)
+            ])
+            await server.rebuild_ranking_windows(database)
+            return await database.ranking_buckets.find({"user_id": "u1"}, {"_id": 0}).to_list(None)
+        finally:
+            await client.drop_database(database.name)
+            client.close()
+
+    rows = asyncio.run(scenario())
+    expected = expected_buckets()
+    assert {row["board"] for row in rows} == set(expected)
+    assert "week:2020-W53" in expected and "week:2025-W01" in expected and "month:2025-02" in expected
+    for row in rows:
+        bucket = expected[row["board"]]
+        assert (row["total_questions"], row["correct_answers"]) == \
+            (bucket["total_questions"], bucket["correct_answers"]), row["board"]
+        assert row["expires_at"].replace(tzinfo=timezone.utc) == bucket["expires_at"], row["board"]
+        assert row["name"] == "Ana"
@@ -0,0 +1,144 @@
+import asyncio
+
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+import server
+
+
+class FakeCollection:
+    def __init__(self):
+        self.calls = []
+        self.failures = []
+
+    async def bulk_write(self, requests, ordered=True):
+        self.calls.append(requests)
+        if self.failures:
+            raise self.failures.pop(0)
+
+    async def insert_many(self, documents, ordered=True):
+        self.calls.append(documents)
+        if self.failures:
+            raise self.failures.pop(0)
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.collections = {}
+
+    def __getitem__(self, name):
+        return self.collections.setdefault(name, FakeCollection())
+
+    def __getattr__(self, name):
+        return self[name]
+
+
+def bulk_error(*errors):
+    return BulkWriteError({"writeErrors": [{"index": index, "code": code, "errmsg": "x"} for index, code in errors]})
+
+
+def ops(*names):
+    return [({"user_id": name}, [{"$set": {"n": 1}}]) for name in names]
+
+
+def make_buffer(max_pending=100):
+    return server.AnswerWriteBuffer(FakeDatabase(), batch_size=10, flush_interval=1, max_pending=max_pending)
+
+
+def entry(index):
+    answer = {"id": f"a{index}", "user_id": "u1", "question_id": "q1", "selected_option": 0, "is_correct": True,
+              "answered_at": "2026-03-10T12:00:00+00:00", "time_spent": 10}
+    question = {"id": "q1", "subject_id": "s1", "difficulty": "easy", "ordinal": 3}
+    return answer, question, "Ana"
+
+
+def test_partial_failure_retries_only_failed_ops():
+    buffer = make_buffer()
+    collection = buffer.database["results"]
+    collection.failures = [bulk_error((1, 11000), (2, 2))]
+    buffer._pending_updates = [("results", ops("a", "b", "c"))]
+
+    asyncio.run(buffer._apply_updates())
+    # "a" applied, "c" can never apply and is dropped, only the lost upsert race is retried
+    assert buffer._pending_updates == [("results", ops("b"))]
+
+    asyncio.run(buffer._apply_updates())
+    assert [request._filter for request in collection.calls[-1]] == [{"user_id": "b"}]
+    assert buffer._pending_updates == []
+
+
+def test_connection_error_retries_whole_group():
+    buffer = make_buffer()
+    buffer.database["leaderboard"].failures = [AutoReconnect("down")]
+    buffer._pending_updates = [("leaderboard", ops("a", "b"))]
+
+    asyncio.run(buffer._apply_updates())
+    assert buffer._pending_updates == [("leaderboard", ops("a", "b"))]
+
+
+def test_pending_counters_do_not_fail_flush_or_add():
+    buffer = make_buffer(max_pending=2)
+    for collection_name in ("results", "leaderboard", "ranking_buckets", "answered_sets", "study_days",
+                            "question_stats"):
+        buffer.database[collection_name].failures = [AutoReconnect("down")] * 10
+
+    async def scenario():
+        await buffer.add(*entry(0))
+        await buffer.add(*entry(1))
+        # At capacity: the flush inserts the answers, so the new answer is accepted despite pending counters
+        await buffer.add(*entry(2))
+        await buffer.flush()
+
+    asyncio.run(scenario())
+    assert buffer._entries == []
+    assert len(buffer.database["answers"].calls) == 2
+
+
+def test_pending_counters_are_capped():
+    buffer = make_buffer(max_pending=3)
+    buffer.database["results"].failures = [AutoReconnect("down")] * 2
+    buffer._pending_updates = [("results", ops("a", "b")), ("results", ops("c", "d"))]
+
+    asyncio.run(buffer._apply_updates())
+    assert buffer._pending_updates == [("results", ops("c", "d"))]
+
+
+def test_add_returns_503_when_answers_cannot_be_inserted():
+    buffer = make_buffer(max_pending=1)
+    buffer.database["answers"].failures = [AutoReconnect("down")]
+
+    async def scenario():
+        await buffer.add(*entry(0))
+        with pytest.raises(server.HTTPException) as error:
+            await buffer.add(*entry(1))
+        return error.value
+
+    assert asyncio.run(scenario()).status_code == 503
+    assert [answer["id"] for answer, _, _ in buffer._entries] == ["a0"]
+
+
+def test_add_many_is_all_or_nothing():
+    buffer = make_buffer(max_pending=3)
+    buffer.database["answers"].failures = [AutoReconnect("down")]
+
+    async def scenario():
+        await buffer.add(*entry(0))
+        await buffer.add(*entry(1))
+        with pytest.raises(server.HTTPException):
+            await buffer.add_many([entry(2), entry(3)])
+        # Once the insert works again the whole batch is accepted
+        await buffer.add_many([entry(2), entry(3)])
+
+    asyncio.run(scenario())
+    assert [answer["id"] for answer, _, _ in buffer._entries] == ["a2", "a3"]
+    assert [answer["id"] for answer in buffer.database["answers"].calls[-1]] == ["a0", "a1"]
+
+
+def test_unexpected_error_drops_only_its_group():
+    buffer = make_buffer()
+    buffer.database["study_days"].failures = [ValueError("cannot encode")]
+    buffer._pending_updates = [("study_days", ops("a")), ("results", ops("b"))]
+
+    asyncio.run(buffer._apply_updates())
+    assert buffer._pending_updates == []
+    assert len(buffer.database["results"].calls) == 1